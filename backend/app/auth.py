@@ -2,6 +2,9 @@
 认证与权限中间件
 """
 
+from dataclasses import dataclass, field
+from functools import reduce
+import operator
 from typing import Optional, List
 from datetime import datetime, timedelta
 from jose import jwt, JWTError
@@ -9,12 +12,15 @@ from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, Header, status
 import secrets
 import hashlib
+import hmac
 
-from app.config import settings
+from app.config import BCRYPT_ROUNDS, settings
 from app.models_v2 import get_session, User, Organization, OrganizationMember, APIKey
 
 # 密码加密
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(
+    schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS
+)
 
 
 # ==================== 权限定义 ====================
@@ -96,26 +102,36 @@ ROLE_PERMISSIONS = {
     ],
 }
 
+# 权限位图: 导入时为每个 Permission 常量分配一位, 角色权限合并为一个整数
+# Permission 常量仍是字符串, 位图只在 has_permission 内部使用
+_PERMISSION_BITS = {
+    value: 1 << i
+    for i, value in enumerate(
+        v for k, v in vars(Permission).items() if k.isupper() and isinstance(v, str)
+    )
+}
+_ROLE_MASKS = {
+    role: reduce(operator.or_, (_PERMISSION_BITS[p] for p in perms), 0)
+    for role, perms in ROLE_PERMISSIONS.items()
+}
+
 
 # ==================== 依赖注入 ====================
 
 
+@dataclass(slots=True)
 class AuthContext:
     """认证上下文"""
 
-    def __init__(
-        self,
-        user: Optional[User] = None,
-        organization: Optional[Organization] = None,
-        member_role: str = None,
-        is_api_key: bool = False,
-        api_scopes: List[str] = None,
-    ):
-        self.user = user
-        self.organization = organization
-        self.member_role = member_role
-        self.is_api_key = is_api_key
-        self.api_scopes = api_scopes or []
+    user: Optional[User] = None
+    organization: Optional[Organization] = None
+    member_role: Optional[str] = None
+    is_api_key: bool = False
+    api_scopes: List[str] = field(default_factory=list)
+
+    def __post_init__(self):
+        if self.api_scopes is None:
+            self.api_scopes = []
 
     @property
     def user_id(self) -> Optional[str]:
@@ -159,18 +175,14 @@ async def authenticate_api_key(
     """API Key 认证"""
     session = get_session()
     try:
-        # 查找 API Key
+        # 按 ID 查找 API Key, 哈希在应用侧做常量时间比较
         api_key = (
             session.query(APIKey)
-            .filter(
-                APIKey.id == key_id,
-                APIKey.key_hash == hash_api_key(key),
-                APIKey.is_active == True,
-            )
+            .filter(APIKey.id == key_id, APIKey.is_active == True)
             .first()
         )
 
-        if not api_key:
+        if not api_key or not hmac.compare_digest(api_key.key_hash, hash_api_key(key)):
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid API Key"
             )
@@ -292,8 +304,9 @@ def has_permission(auth: AuthContext, permission: str) -> bool:
     if not auth.user or not auth.member_role:
         return False
 
-    user_permissions = ROLE_PERMISSIONS.get(auth.member_role, [])
-    return permission in user_permissions
+    return bool(
+        _ROLE_MASKS.get(auth.member_role, 0) & _PERMISSION_BITS.get(permission, 0)
+    )
 
 
 def require_organization(auth: AuthContext = Depends(get_current_user)) -> AuthContext:
@@ -23,7 +23,7 @@ class Cache:
 
     def __init__(self):
         self.client = None
-        self.prefix = "litekb:"
+        self.prefix = settings.redis_key_prefix
 
     async def connect(self):
         """连接 Redis"""
@@ -70,7 +70,7 @@ class Cache:
 
     def make_key(self, *parts: str) -> str:
         """生成缓存 Key"""
-        return hashlib.md5(":".join(parts).encode()).hexdigest()
+        return hashlib.blake2b(":".join(parts).encode(), digest_size=16).hexdigest()
 
 
 # 全局缓存实例
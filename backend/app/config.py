@@ -2,10 +2,14 @@
 LiteKB 核心配置
 """
 
+import os
 from pydantic_settings import BaseSettings
 from typing import Optional
 from functools import lru_cache
 
+# bcrypt 轮数: 测试环境 (TESTING=1) 用最小值 4, 生产保持 12
+BCRYPT_ROUNDS = 4 if os.getenv("TESTING") else 12
+
 
 class Settings(BaseSettings):
     # 应用配置
@@ -21,6 +25,13 @@ class Settings(BaseSettings):
     qdrant_api_key: Optional[str] = None
     qdrant_collection: str = "litekb_chunks"
 
+    # Redis 键前缀
+    redis_key_prefix: str = "litekb:"
+
+    # Celery (docker-compose 以大写环境变量传入)
+    celery_broker_url: str = os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0")
+    celery_result_url: str = os.getenv("CELERY_RESULT_URL", "redis://localhost:6379/1")
+
     # Neo4j 图数据库
     neo4j_url: str = "bolt://localhost:7687"
     neo4j_user: str = "neo4j"
@@ -47,9 +58,34 @@ class Settings(BaseSettings):
         case_sensitive = True
 
 
+def _namespace_for_worker(s: Settings, worker: str) -> Settings:
+    """pytest-xdist 并行测试时按 worker 隔离 SQLite 文件/Redis 前缀
+
+    向量库为进程内存储, 无需隔离。
+    """
+    # 显式设置的 DATABASE_URL 同样需要隔离, 否则各 worker 共用一个库
+    url = os.getenv("DATABASE_URL") or s.database_url
+    suffix = f"_{worker}.db"
+    if (
+        url.startswith("sqlite:///")
+        and url.endswith(".db")
+        and not url.endswith(suffix)
+    ):
+        url = url[:-3] + suffix
+    s.database_url = url
+    s.redis_key_prefix = f"{s.redis_key_prefix}{worker}:"
+    # orm_store 直接读取环境变量, 此处无条件覆盖
+    os.environ["DATABASE_URL"] = url
+    return s
+
+
 @lru_cache()
 def get_settings() -> Settings:
-    return Settings()
+    s = Settings()
+    worker = os.getenv("PYTEST_XDIST_WORKER")
+    if worker:
+        s = _namespace_for_worker(s, worker)
+    return s
 
 
 settings = get_settings()
@@ -47,6 +47,7 @@ class User(Base):
 
     relationships = relationship("OrganizationMember", back_populates="user")
     api_keys = relationship("APIKey", back_populates="user")
+    settings = relationship("UserSetting", back_populates="user", uselist=False)
 
 
 class UserSetting(Base):
@@ -6,7 +6,7 @@ import os
 from typing import Dict, Any, Optional, List
 from datetime import datetime
 from sqlalchemy.orm import Session, sessionmaker
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, insert, select, text
 from loguru import logger
 
 from app.data_models import (
@@ -220,8 +220,9 @@ class ORMStore:
                 id=doc_id,
                 title=data["title"],
                 content=data.get("content"),
-                file_type=data.get("file_type"),
                 file_size=data.get("file_size"),
+                file_hash=data.get("file_hash"),
+                extra_metadata=data.get("metadata") or {},
                 kb_id=data["kb_id"],
             )
             session.add(doc)
@@ -229,6 +230,32 @@ class ORMStore:
             session.refresh(doc)
             return doc
 
+    def create_docs(self, items: List[tuple]) -> List[Any]:
+        """批量创建文档, items 为 (doc_id, data) 列表; 一条 executemany 写入, 一条查询取回"""
+        table = Document.__table__
+        rows = [
+            {
+                "id": doc_id,
+                "kb_id": data["kb_id"],
+                "title": data["title"],
+                "content": data.get("content"),
+                "file_size": data.get("file_size"),
+                "file_hash": data.get("file_hash"),
+                "extra_metadata": data.get("metadata") or {},
+            }
+            for doc_id, data in items
+        ]
+        if not rows:
+            return []
+        with self.get_session() as session:
+            session.execute(insert(table), rows)
+            session.commit()
+            created = session.execute(
+                select(table).where(table.c.id.in_([r["id"] for r in rows]))
+            ).all()
+        order = {r["id"]: i for i, r in enumerate(rows)}
+        return sorted(created, key=lambda r: order[r.id])
+
     def get_doc(self, doc_id: str) -> Optional[Document]:
         with self.get_session() as session:
             return session.query(Document).filter(Document.id == doc_id).first()
@@ -2,17 +2,19 @@
 main.py - LiteKB API Server (生产优化版)
 """
 
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Request, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
-from pydantic import BaseModel, EmailStr
-from typing import Optional, List
+from fastapi.security import OAuth2PasswordBearer
+from pydantic import BaseModel, ConfigDict, EmailStr, Field
+from typing import Annotated, Optional, List
 from datetime import datetime, timedelta
 from jose import jwt, JWTError
 from passlib.context import CryptContext
 import uuid
 import os
 import json
+import hashlib
 
 # ==================== 配置 ====================
 
@@ -54,8 +56,12 @@ async def lifespan(app: FastAPI):
     setup_sentry()
 
     yield
-    # 关闭时清理
-    pass
+    # 关闭时清理: 先提交缓冲的请求事件, 再上报并关闭 Langfuse
+    from app.tracing.langfuse import langfuse_tracing
+    from app.tracing.middleware import event_batcher
+
+    await event_batcher.close()
+    await langfuse_tracing.close()
 
 
 app = FastAPI(
@@ -101,7 +107,13 @@ if not DEBUG:
 # ==================== 数据模型 (增强验证) ====================
 
 
-class Token(BaseModel):
+class ResponseModel(BaseModel):
+    """响应模型基类: 不可变, 可直接从 ORM 对象/行读取属性"""
+
+    model_config = ConfigDict(frozen=True, from_attributes=True)
+
+
+class Token(ResponseModel):
     access_token: str
     token_type: str
 
@@ -117,7 +129,7 @@ class UserCreate(BaseModel):
     password: str
 
 
-class User(BaseModel):
+class User(ResponseModel):
     id: str
     username: str
     email: Optional[str]
@@ -129,7 +141,7 @@ class KnowledgeBaseCreate(BaseModel):
     description: Optional[str] = None
 
 
-class KnowledgeBase(BaseModel):
+class KnowledgeBase(ResponseModel):
     id: str
     name: str
     description: Optional[str]
@@ -143,7 +155,12 @@ class DocumentCreate(BaseModel):
     metadata: Optional[dict] = None
 
 
-class Document(BaseModel):
+# 批量创建单次请求的文档数上限 (一次事务写入)
+DOCS_BATCH_MAX = 100
+DocumentBatch = Annotated[List[DocumentCreate], Field(max_length=DOCS_BATCH_MAX)]
+
+
+class Document(ResponseModel):
     id: str
     title: str
     content: Optional[str]
@@ -167,9 +184,12 @@ class SearchRequest(BaseModel):
 
 # ==================== 数据库 ====================
 
+from app.config import BCRYPT_ROUNDS
 from app.db.factory import db
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(
+    schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS
+)
 
 # ==================== 辅助函数 ====================
 
@@ -189,8 +209,11 @@ def verify_password(plain: str, hashed: str) -> bool:
 
 # ==================== 认证依赖 ====================
 
+# 前端通过 Authorization: Bearer <token> 传递令牌
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/login")
+
 
-async def get_current_user(token: str) -> User:
+async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -323,6 +346,71 @@ async def create_doc(
     return db.create_doc(str(uuid.uuid4()), doc_data)
 
 
+@app.post("/api/v1/kb/{kb_id}/docs/stream", response_model=Document)
+async def create_doc_stream(
+    kb_id: str,
+    request: Request,
+    filename: str,
+    title: Optional[str] = None,
+    current_user: User = Depends(get_current_user),
+):
+    """流式上传文档: 请求体为原始文件内容, 按块读取, 不经 multipart 解析和临时文件"""
+    kb = db.get_kb(kb_id)
+    if not kb:
+        raise HTTPException(status_code=404, detail="Knowledge base not found")
+
+    from app.services.document import DocumentProcessor
+    from app.services.file import FileService
+
+    hasher = hashlib.sha256()
+    content = bytearray()
+    async for chunk in request.stream():
+        content += chunk
+        if len(content) > FileService.MAX_SIZE:
+            raise HTTPException(status_code=413, detail="File too large")
+        hasher.update(chunk)
+
+    try:
+        text = await DocumentProcessor().extract_text(bytes(content), filename)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    doc_data = {
+        "kb_id": kb_id,
+        "title": title or os.path.splitext(filename)[0],
+        "content": text,
+        "file_size": len(content),
+        "file_hash": hasher.hexdigest(),
+    }
+    return db.create_doc(str(uuid.uuid4()), doc_data)
+
+
+@app.post("/api/v1/kb/{kb_id}/docs:batch", response_model=List[Document])
+async def create_docs_batch(
+    kb_id: str,
+    docs: DocumentBatch,
+    current_user: User = Depends(get_current_user),
+):
+    """批量创建文档 (一次请求, 一次事务), 超过 DOCS_BATCH_MAX 条返回 422"""
+    kb = db.get_kb(kb_id)
+    if not kb:
+        raise HTTPException(status_code=404, detail="Knowledge base not found")
+
+    items = [
+        (
+            str(uuid.uuid4()),
+            {
+                "kb_id": kb_id,
+                "title": doc.title,
+                "content": doc.content,
+                "metadata": doc.metadata,
+            },
+        )
+        for doc in docs
+    ]
+    return db.create_docs(items)
+
+
 @app.get("/api/v1/kb/{kb_id}/docs", response_model=List[Document])
 async def list_documents(
     kb_id: str,
@@ -606,4 +694,13 @@ async def metrics():
 if __name__ == "__main__":
     import uvicorn
 
-    uvicorn.run(app, host="0.0.0.0", port=8000, workers=4, loop="uvloop")
+    # 多 worker 需传入导入路径; 请求已由 TracingMiddleware 记录, 关闭访问日志
+    uvicorn.run(
+        "app.main:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=4,
+        loop="uvloop",
+        http="httptools",
+        access_log=False,
+    )
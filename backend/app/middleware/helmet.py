@@ -37,7 +37,9 @@ class HelmetMiddleware(BaseHTTPMiddleware):
                 response.headers[key] = value
 
         # 移除敏感 Headers
-        response.headers.pop("X- Powered-By", None)
+        # (MutableHeaders 没有 pop 方法)
+        if "X-Powered-By" in response.headers:
+            del response.headers["X-Powered-By"]
 
         return response
 
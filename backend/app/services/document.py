@@ -7,10 +7,14 @@ import uuid
 from pathlib import Path
 from typing import List, Optional, Dict, Any
 from loguru import logger
+from sqlalchemy import insert
 
 from app.config import settings
 from app.data_models import Document, DocumentChunk
 
+# 分块断句符, 按优先级排列 (含中文句末标点)
+CHUNK_SEPARATORS = (". ", "? ", "! ", "。", "！", "？", "\n")
+
 
 class DocumentProcessor:
     """文档处理器"""
@@ -93,7 +97,7 @@ class DocumentProcessor:
             end = start + self.chunk_size
 
             if end < len(text):
-                for sep in [". ", "? ", "! ", "\n"]:
+                for sep in CHUNK_SEPARATORS:
                     last_sep = text.rfind(sep, start, end)
                     if last_sep > start + self.chunk_size // 2:
                         end = last_sep + len(sep)
@@ -134,25 +138,32 @@ class DocumentService:
 
             doc = Document(
                 id=str(uuid.uuid4()),
+                kb_id=kb_id,
                 title=title,
-                file_type=processed["file_type"],
                 content=processed["content"],
-                metadata=processed["metadata"],
+                extra_metadata={
+                    **processed["metadata"],
+                    "file_type": processed["file_type"],
+                },
                 status="processing",
             )
             session.add(doc)
             session.flush()
 
-            for i, chunk_content in enumerate(processed["chunks"]):
-                chunk = DocumentChunk(
-                    id=str(uuid.uuid4()),
-                    doc_id=doc.id,
-                    kb_id=kb_id,
-                    chunk_index=i,
-                    content=chunk_content,
-                    metadata={"source": filename},
-                )
-                session.add(chunk)
+            # 所有分块一条 executemany 写入
+            chunk_rows = [
+                {
+                    "id": str(uuid.uuid4()),
+                    "doc_id": doc.id,
+                    "kb_id": kb_id,
+                    "chunk_index": i,
+                    "content": chunk_content,
+                    "extra_metadata": {"source": filename},
+                }
+                for i, chunk_content in enumerate(processed["chunks"])
+            ]
+            if chunk_rows:
+                session.execute(insert(DocumentChunk.__table__), chunk_rows)
 
             session.commit()
             doc.status = "indexed"
@@ -2,12 +2,39 @@
 提示词管理器 - Langfuse 集成
 """
 
+import functools
 import os
+import re
+import threading
+import time
+from types import MappingProxyType
 from typing import Dict, Any, Optional, List
+from cachetools import TTLCache
 from loguru import logger
 
+# Langfuse 提示词缓存上限与过期时间 (秒)
+PROMPT_CACHE_SIZE = 256
+PROMPT_CACHE_TTL = 300
+# 加载名称索引时每页条数
+PROMPT_INDEX_PAGE_SIZE = 100
+
+# 模板变量: {{name}}、${name} 或 {name}, 各分支只有一个捕获组命中
+# (app.tracing.langfuse 渲染 Langfuse 提示词时共用此模式)
+VARIABLE_PATTERN = re.compile(r"\{\{\s*(\w+)\s*\}\}|\$\{(\w+)\}|\{(\w+)\}")
+
+
+def _render(template: str, variables: Dict[str, Any]) -> str:
+    """渲染模板, 未提供的变量保留占位符原文"""
+
+    def substitute(match: re.Match) -> str:
+        key = match[match.lastindex]
+        return str(variables[key]) if key in variables else match.group(0)
+
+    return VARIABLE_PATTERN.sub(substitute, template)
+
+
 # 默认提示词模板
-DEFAULT_PROMPTS = {
+_DEFAULT_PROMPTS = {
     # RAG
     "rag_naive": {
         "prompt": """你是知识库助手。请基于以下上下文回答用户的问题。
@@ -197,12 +224,23 @@ Chunks：""",
 }
 
 
+# 只读视图: 进程内共享, 不允许运行时修改
+DEFAULT_PROMPTS = MappingProxyType(_DEFAULT_PROMPTS)
+
+
 class PromptManager:
     """提示词管理器 - 集成 Langfuse"""
 
     def __init__(self):
         self._langfuse_client = None
         self._enabled = False
+        # Langfuse 上已有的提示词名称, 与提示词缓存同样按 PROMPT_CACHE_TTL 过期重载
+        self._index: Optional[set] = None
+        self._index_expires = 0.0
+        self._index_loading = False
+        self._cache = TTLCache(maxsize=PROMPT_CACHE_SIZE, ttl=PROMPT_CACHE_TTL)
+        # 同步接口可能在线程池中并发调用, 索引与缓存的读写需加锁
+        self._lock = threading.RLock()
         self._init_langfuse()
 
     def _init_langfuse(self):
@@ -226,6 +264,68 @@ class PromptManager:
             logger.warning(f"PromptManager: Langfuse init failed: {e}")
             self._enabled = False
 
+    def _in_langfuse(self, name: str) -> bool:
+        """按名称索引判断是否需要请求 Langfuse, 索引不可用时总是请求"""
+        if not (self._enabled and self._langfuse_client):
+            return False
+
+        if time.monotonic() >= self._index_expires and not self._index_loading:
+            # 只由一个线程重载; 网络请求在锁外进行, 期间其他线程沿用旧索引
+            with self._lock:
+                reload = not self._index_loading
+                self._index_loading = True
+            if reload:
+                # _load_index 自行处理异常, 失败时返回 None
+                index = self._load_index()
+                with self._lock:
+                    self._index = index
+                    self._index_expires = time.monotonic() + PROMPT_CACHE_TTL
+                    self._index_loading = False
+
+        index = self._index
+        return index is None or name in index
+
+    def _load_index(self) -> Optional[set]:
+        """分页加载 Langfuse 上的全部提示词名称, 失败时返回 None"""
+        names = set()
+        page = 1
+        try:
+            while True:
+                prompts = self._langfuse_client.get_prompts(
+                    page=page, limit=PROMPT_INDEX_PAGE_SIZE
+                )
+                names.update(p.name for p in prompts.data)
+                total_pages = getattr(prompts.meta, "total_pages", page)
+                if page >= total_pages or not prompts.data:
+                    return names
+                page += 1
+        except Exception as e:
+            logger.debug(f"Load Langfuse prompt index failed: {e}")
+            return None
+
+    def _fetch_langfuse(self, name: str) -> Optional[str]:
+        """从 Langfuse 获取提示词原文, 结果按名称缓存"""
+        if not self._in_langfuse(name):
+            return None
+
+        with self._lock:
+            prompt_text = self._cache.get(name)
+        if prompt_text is not None:
+            return prompt_text
+
+        try:
+            langfuse_prompt = self._langfuse_client.get_prompt(name=name)
+        except Exception:
+            logger.debug(f"Langfuse prompt not found: {name}")
+            return None
+
+        if langfuse_prompt and langfuse_prompt.prompt:
+            with self._lock:
+                self._cache[name] = langfuse_prompt.prompt
+            logger.debug(f"Prompt from Langfuse: {name}")
+            return langfuse_prompt.prompt
+        return None
+
     def get_prompt(self, name: str, variables: Dict[str, str] = None) -> str:
         """
         获取并渲染提示词
@@ -237,17 +337,8 @@ class PromptManager:
         Returns:
             渲染后的提示词
         """
-        prompt_text = None
-
         # 1. 优先从 Langfuse 获取
-        if self._enabled and self._langfuse_client:
-            try:
-                langfuse_prompt = self._langfuse_client.get_prompt(name=name)
-                if langfuse_prompt:
-                    prompt_text = langfuse_prompt.prompt
-                    logger.debug(f"Prompt from Langfuse: {name}")
-            except Exception as e:
-                logger.debug(f"Langfuse prompt not found: {name}")
+        prompt_text = self._fetch_langfuse(name)
 
         # 2. 回退到默认模板
         if not prompt_text:
@@ -260,20 +351,15 @@ class PromptManager:
 
         # 3. 渲染变量
         if variables:
-            for key, value in variables.items():
-                prompt_text = prompt_text.replace(f"{{{{{key}}}}}", str(value))
-                prompt_text = prompt_text.replace(f"${{{key}}}", str(value))
+            prompt_text = _render(prompt_text, variables)
 
         return prompt_text
 
     def get_raw_prompt(self, name: str) -> Optional[str]:
         """获取原始提示词"""
-        if self._enabled and self._langfuse_client:
-            try:
-                prompt = self._langfuse_client.get_prompt(name=name)
-                return prompt.prompt
-            except Exception:
-                pass
+        prompt_text = self._fetch_langfuse(name)
+        if prompt_text is not None:
+            return prompt_text
 
         if name in DEFAULT_PROMPTS:
             return DEFAULT_PROMPTS[name]["prompt"]
@@ -295,19 +381,30 @@ class PromptManager:
                 prompt=prompt_data["prompt"],
                 config={"description": prompt_data["description"]},
             )
+            with self._lock:
+                if self._index is not None:
+                    self._index.add(name)
+                self._cache.pop(name, None)
             logger.info(f"Synced prompt to Langfuse: {name}")
             return True
         except Exception as e:
             logger.error(f"Sync prompt failed: {e}")
             return False
 
-    def sync_all_to_langfuse(self):
-        """同步所有默认提示词到 Langfuse"""
+    def sync_all_to_langfuse(self, force: bool = False):
+        """同步所有默认提示词到 Langfuse
+
+        Args:
+            force: 为 False 时跳过 Langfuse 上已存在的提示词, 避免重复创建版本
+        """
         if not self._enabled:
             logger.warning("Langfuse not enabled")
             return
 
         for name in DEFAULT_PROMPTS:
+            # _in_langfuse 在索引过期时重新加载
+            if not force and self._in_langfuse(name) and self._index is not None:
+                continue
             self.sync_to_langfuse(name)
 
         logger.info("All prompts synced to Langfuse")
@@ -348,8 +445,10 @@ class PromptManager:
         return prompts
 
 
-# 全局实例
-prompt_manager = PromptManager()
+# 全局实例 (首次使用时创建, 导入本模块不会连接 Langfuse)
+@functools.lru_cache(maxsize=1)
+def get_prompt_manager() -> PromptManager:
+    return PromptManager()
 
 
 # ============== 便捷函数 =============
@@ -357,12 +456,12 @@ prompt_manager = PromptManager()
 
 def get_prompt(name: str, variables: Dict[str, str] = None) -> str:
     """获取提示词"""
-    return prompt_manager.get_prompt(name, variables)
+    return get_prompt_manager().get_prompt(name, variables)
 
 
 def render_prompt(name: str, **variables) -> str:
     """渲染提示词"""
-    return prompt_manager.get_prompt(name, variables)
+    return get_prompt_manager().get_prompt(name, variables)
 
 
 def rag_prompt(
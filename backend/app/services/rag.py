@@ -11,6 +11,7 @@ from app.services.search import SearchService, SearchResult
 from app.services.prompt import get_prompt
 from app.db.orm_store import orm_store
 
+
 # 获取 session 的函数
 def get_session():
     return orm_store.get_session()
@@ -2,10 +2,11 @@
 搜索服务
 """
 
+import heapq
 from typing import List, Dict, Any, Optional
 from loguru import logger
 from datetime import datetime
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass
 
 
 @dataclass
@@ -27,25 +28,29 @@ def rrf_fuse(
     k: int = 60,
 ) -> List[Dict]:
     """
-    RRF 融合
+    RRF 融合: 每个列表内按名次计 1 / (rank + k), 同一 id 的分数累加
+
+    结果项可以是 dict 或 SearchResult, 缺少 id 的项单独计分, 不参与合并
     """
-    all_results = vector_results + keyword_results
-    
-    type_scores = {}
-    for r in all_results:
-        type_ = r.get("type", "default")
-        if type_ not in type_scores:
-            type_scores[type_] = []
-        type_scores[type_].append(r)
-
-    rrf_scores = []
-    for type_, items in type_scores.items():
-        for rank, item in enumerate(items, 1):
-            score = 1 / (rank + k)
-            rrf_scores.append({**item, "rrf_score": score})
-
-    rrf_scores.sort(key=lambda x: x.get("rrf_score", 0), reverse=True)
-    return rrf_scores[:top_k]
+    scores: Dict[Any, float] = {}
+    items: Dict[Any, Any] = {}
+    for results in (vector_results, keyword_results):
+        for rank, item in enumerate(results, 1):
+            id_ = item.get("id") if isinstance(item, dict) else item.id
+            if id_ is None:
+                id_ = id(item)
+            scores[id_] = scores.get(id_, 0.0) + 1 / (rank + k)
+            items.setdefault(id_, item)
+
+    top = heapq.nlargest(top_k, scores.items(), key=lambda x: x[1])
+    return [
+        (
+            {**items[id_], "rrf_score": score}
+            if isinstance(items[id_], dict)
+            else {**asdict(items[id_]), "rrf_score": score}
+        )
+        for id_, score in top
+    ]
 
 
 class SearchService:
@@ -8,7 +8,11 @@ from jose import JWTError, jwt
 from loguru import logger
 from passlib.context import CryptContext
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from app.config import BCRYPT_ROUNDS
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS
+)
 
 # 配置
 SECRET_KEY = "your-secret-key-change-in-production"
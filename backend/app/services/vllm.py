@@ -3,10 +3,35 @@ vLLM 本地模型客户端
 """
 
 from typing import List, Dict, Optional, AsyncGenerator
+from urllib.parse import urlparse
+
+import httpx
 from loguru import logger
 from openai import AsyncOpenAI
 
 
+def _detect_http2(base_url: str) -> bool:
+    """https 且安装了 h2 时启用 HTTP/2"""
+    if urlparse(base_url).scheme != "https":
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        logger.debug("h2 not installed, vLLM client falls back to HTTP/1.1")
+        return False
+    return True
+
+
+def _build_messages(prompt: str, system: Optional[str] = None) -> List[Dict[str, str]]:
+    """一次性构造 system + user 消息列表"""
+    if system:
+        return [
+            {"role": "system", "content": system},
+            {"role": "user", "content": prompt},
+        ]
+    return [{"role": "user", "content": prompt}]
+
+
 class VLLMClient:
     """vLLM 客户端 (OpenAI 兼容 API)"""
 
@@ -32,10 +57,19 @@ class VLLMClient:
         base_url: str = "http://localhost:8000/v1",
         api_key: str = "sk-no-key",
         timeout: int = 120,
+        http2: Optional[bool] = None,
+        max_connections: int = 256,
+        max_keepalive_connections: int = 64,
     ):
         self.base_url = base_url
         self.api_key = api_key
         self.timeout = timeout
+        # HTTP/2 多路复用通常需要 TLS, 默认仅对 https 开启
+        self.http2 = _detect_http2(base_url) if http2 is None else http2
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+        )
         self._client = None
 
     @property
@@ -46,6 +80,11 @@ class VLLMClient:
                 base_url=self.base_url,
                 api_key=self.api_key,
                 timeout=self.timeout,
+                http_client=httpx.AsyncClient(
+                    http2=self.http2,
+                    limits=self.limits,
+                    timeout=self.timeout,
+                ),
             )
         return self._client
 
@@ -77,10 +116,7 @@ class VLLMClient:
     ) -> str:
         """生成文本 (非流式)"""
 
-        messages = []
-        if system:
-            messages.append({"role": "system", "content": system})
-        messages.append({"role": "user", "content": prompt})
+        messages = _build_messages(prompt, system)
 
         return await self.chat(
             messages=messages,
@@ -100,10 +136,7 @@ class VLLMClient:
     ) -> AsyncGenerator[str, None]:
         """生成文本 (流式)"""
 
-        messages = []
-        if system:
-            messages.append({"role": "system", "content": system})
-        messages.append({"role": "user", "content": prompt})
+        messages = _build_messages(prompt, system)
 
         async for chunk in self.chat_stream(
             messages=messages,
@@ -37,58 +37,155 @@ def process_document(self, doc_id: str, kb_id: str):
     - 生成向量
     - 构建图谱
     """
+    import asyncio
+    from app.db.orm_store import orm_store
+    from app.data_models import Document
     from app.services.document import document_service
-    from app.services.vector import vector_store
     from app.services.graph import graph_service
+    from app.services.vector import embedding_api, vector_store
+
+    session = orm_store.get_session()
+    doc = session.get(Document, doc_id)
+    if not doc:
+        session.close()
+        return {"error": "Document not found"}
 
     try:
-        # 1. 获取文档
-        from app.models_v2 import get_session, Document
+        # 1. 标记处理中
+        doc.status = "processing"
+        session.commit()
 
-        session = get_session()
-        doc = session.query(Document).get(doc_id)
+        # 2. 分块
+        chunks = document_service.processor.split_chunks(doc.content or "")
+        content = doc.content or ""
+
+        async def _index():
+            # 3. 生成向量并写入向量库
+            if chunks:
+                embeddings = await embedding_api.embed_texts(chunks)
+                await vector_store.add(
+                    [f"{doc_id}_{i}" for i in range(len(chunks))],
+                    embeddings,
+                    chunks,
+                    [
+                        {"doc_id": doc_id, "kb_id": kb_id, "chunk_index": i}
+                        for i in range(len(chunks))
+                    ],
+                )
+
+            # 4. 构建知识图谱
+            if content:
+                await graph_service.build_graph(kb_id, doc_id, content[:10000])
+
+        asyncio.run(_index())
+
+        # 5. 更新状态
+        doc.status = "indexed"
+        doc.extra_metadata = {**(doc.extra_metadata or {}), "chunk_count": len(chunks)}
+        session.commit()
 
-        if not doc:
-            return {"error": "Document not found"}
+        return {"doc_id": doc_id, "chunks_count": len(chunks), "status": "completed"}
 
-        # 2. 解析文档
-        doc.status = "processing"
+    except Exception as e:
+        session.rollback()
+        doc.status = "error"
+        doc.error_message = str(e)
         session.commit()
 
-        # 3. 分块并索引
-        chunks = document_service.split_chunks(doc.content or "")
+        raise self.retry(exc=e, countdown=60)
 
-        # 4. 生成向量
-        if chunks:
-            embeddings = await vector_store.get_embeddings([c.content for c in chunks])
-            await vector_store.add_chunks(kb_id, chunks, embeddings)
+    finally:
+        session.close()
 
-        # 5. 构建知识图谱
-        if doc.content:
-            await graph_service.build_graph(kb_id, doc_id, doc.content[:10000])
 
-        # 6. 更新状态
-        doc.status = "indexed"
-        doc.metadata["chunk_count"] = len(chunks)
+# 每个批量任务处理的文档数
+INDEX_BATCH_SIZE = 50
+# 单次 embedding 请求的最大文本数
+EMBED_BATCH_SIZE = 256
+
+
+@celery_app.task(bind=True, max_retries=3)
+def process_document_batch(self, doc_ids: list, kb_id: str):
+    """
+    批量处理文档 (异步)
+    - 一次查询取出所有文档
+    - 合并所有分块, 分批生成向量
+    - 一次写入向量库
+    """
+    import asyncio
+    from app.db.orm_store import orm_store
+    from app.data_models import Document
+    from app.services.document import document_service
+    from app.services.vector import embedding_api, vector_store
+
+    session = orm_store.get_session()
+    docs = session.query(Document).filter(Document.id.in_(doc_ids)).all()
+
+    try:
+        for doc in docs:
+            doc.status = "processing"
         session.commit()
 
-        return {"doc_id": doc_id, "chunks_count": len(chunks), "status": "completed"}
+        # 展平所有文档的分块, 记录每个文档的偏移
+        texts, ids, metadata, offsets = [], [], [], []
+        for doc in docs:
+            chunks = document_service.processor.split_chunks(doc.content or "")
+            offsets.append((doc, len(chunks)))
+            for i, chunk in enumerate(chunks):
+                texts.append(chunk)
+                ids.append(f"{doc.id}_{i}")
+                metadata.append({"doc_id": doc.id, "kb_id": kb_id, "chunk_index": i})
+
+        async def _index():
+            embeddings = []
+            for start in range(0, len(texts), EMBED_BATCH_SIZE):
+                embeddings.extend(
+                    await embedding_api.embed_texts(
+                        texts[start : start + EMBED_BATCH_SIZE]
+                    )
+                )
+            if embeddings:
+                await vector_store.add(ids, embeddings, texts, metadata)
+
+        asyncio.run(_index())
+
+        for doc, chunk_count in offsets:
+            doc.status = "indexed"
+            doc.extra_metadata = {
+                **(doc.extra_metadata or {}),
+                "chunk_count": chunk_count,
+            }
+        session.commit()
+
+        return {
+            "kb_id": kb_id,
+            "docs_count": len(docs),
+            "chunks_count": len(texts),
+            "status": "completed",
+        }
 
     except Exception as e:
-        doc.status = "failed"
-        doc.metadata["error"] = str(e)
+        session.rollback()
+        for doc in docs:
+            doc.status = "error"
+            doc.error_message = str(e)
         session.commit()
 
         raise self.retry(exc=e, countdown=60)
 
+    finally:
+        session.close()
+
 
 @celery_app.task
 def index_documents(kb_id: str, doc_ids: list):
     """批量索引文档"""
-    for doc_id in doc_ids:
-        process_document.delay(doc_id, kb_id)
+    batches = 0
+    for start in range(0, len(doc_ids), INDEX_BATCH_SIZE):
+        process_document_batch.delay(doc_ids[start : start + INDEX_BATCH_SIZE], kb_id)
+        batches += 1
 
-    return {"queued": len(doc_ids)}
+    return {"queued": len(doc_ids), "batches": batches}
 
 
 @celery_app.task
@@ -96,12 +193,14 @@ def rebuild_knowledge_graph(kb_id: str):
     """
     重建知识图谱 (定时任务)
     """
+    import asyncio
     from app.services.graph import graph_service
 
     # 获取所有文档
-    from app.models_v2 import get_session, Document
+    from app.db.orm_store import orm_store
+    from app.data_models import Document
 
-    session = get_session()
+    session = orm_store.get_session()
     docs = (
         session.query(Document)
         .filter(Document.kb_id == kb_id, Document.status == "indexed")
@@ -110,10 +209,15 @@ def rebuild_knowledge_graph(kb_id: str):
 
     stats = {"entities": 0, "relations": 0}
 
-    for doc in docs:
-        result = await graph_service.build_graph(kb_id, doc.id, doc.content[:10000])
-        stats["entities"] += result["entities"]
-        stats["relations"] += result["relations"]
+    async def _build():
+        for doc in docs:
+            result = await graph_service.build_graph(
+                kb_id, doc.id, (doc.content or "")[:10000]
+            )
+            stats["entities"] += result["entities"]
+            stats["relations"] += result["relations"]
+
+    asyncio.run(_build())
 
     return stats
 
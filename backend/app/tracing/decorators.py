@@ -2,150 +2,168 @@
 LLM 追踪 - 使用 Langfuse API
 """
 
+import asyncio
 import os
+import reprlib
 import time
-from typing import Callable, Any, Dict, Optional
+from typing import Callable, Any, Dict, Literal, Optional
 from functools import wraps
 from datetime import datetime
 from loguru import logger
-from app.tracing.langfuse import langfuse_tracing
+from app.tracing.langfuse import (
+    LocalSpan,
+    LocalTrace,
+    current_trace_var,
+    langfuse_tracing,
+)
 
+TraceKind = Literal["llm", "retrieval", "generation"]
 
-class LLMTracker:
-    """LLM 追踪器 - 基于 Langfuse"""
+# 有界 repr: 大参数 (长 prompt、向量) 超出上限即截断, 不构造完整字符串
+_REPR = reprlib.Repr()
+_REPR.maxstring = 500
+_REPR.maxother = 500
+_REPR.maxlist = 20
+_REPR.maxtuple = 20
+_REPR.maxdict = 20
 
-    def __init__(self):
-        self.enabled = langfuse_tracing.enabled
 
-    def trace_call(
-        self,
-        name: str = "llm_call",
-        provider: str = None,
-        model: str = None,
-    ) -> Callable:
-        """LLM 调用追踪装饰器"""
+def _template_metadata(template: Dict, kwargs: Dict) -> Dict:
+    return template.copy()
 
-        def decorator(func: Callable) -> Callable:
-            @wraps(func)
-            async def wrapper(*args, **kwargs) -> Any:
-                start_time = time.time()
-                trace = None
-                generation = None
 
-                try:
-                    # 创建追踪
-                    trace = langfuse_tracing.create_trace(
-                        name=f"{name}.{func.__name__}",
-                        metadata={
-                            "provider": provider,
-                            "model": model,
-                            "function": func.__name__,
-                        },
-                    )
-
-                    # 记录开始
-                    trace.event("function_start", {"args": str(args)[:500]})
-
-                    # 执行函数
-                    result = await func(*args, **kwargs)
+def _generation_metadata(template: Dict, kwargs: Dict) -> Dict:
+    return {
+        "model": kwargs.get("model", ""),
+        "prompt_length": len(kwargs.get("prompt", "")),
+    }
 
-                    # 记录结束
-                    duration = (time.time() - start_time) * 1000
-                    trace.event("function_end", {"duration_ms": duration})
 
-                    return result
+def _result_count(result) -> Dict:
+    return {"count": len(result) if result else 0}
 
-                except Exception as e:
-                    if trace:
-                        trace.event("error", {"error": str(e)})
-                    raise
 
-            return wrapper
+def _output_length(result) -> Dict:
+    return {"output_length": len(result) if result else 0}
 
-        return decorator
 
-    def trace_retrieval(
-        self,
-        name: str = "retrieval",
-    ) -> Callable:
-        """检索追踪装饰器"""
+def _emit(trace, name: str, metadata: Dict, end: bool):
+    trace.event(name, metadata)
+    if end:
+        trace.end()
 
-        def decorator(func: Callable) -> Callable:
-            @wraps(func)
-            async def wrapper(*args, **kwargs) -> Any:
-                start_time = time.time()
-                trace = langfuse_tracing.create_trace(
-                    name=name,
-                    metadata={"function": func.__name__},
-                )
 
-                try:
-                    result = await func(*args, **kwargs)
+def _fire_event(trace, name: str, metadata: Dict, end: bool = False):
+    """事件交给事件循环在下一轮记录, 被追踪的协程不等待上报"""
+    asyncio.get_running_loop().call_soon(_emit, trace, name, metadata, end)
 
-                    # 记录检索结果
-                    count = len(result) if result else 0
-                    trace.event(
-                        "retrieval_complete",
-                        {
-                            "count": count,
-                            "duration_ms": (time.time() - start_time) * 1000,
-                        },
-                    )
 
-                    return result
+# kind -> (开始元数据, 结束事件名, 结束元数据)
+_TRACE_KINDS = {
+    "llm": (_template_metadata, "function_end", lambda result: {}),
+    "retrieval": (_template_metadata, "retrieval_complete", _result_count),
+    "generation": (_generation_metadata, "generation_complete", _output_length),
+}
 
-                except Exception as e:
-                    trace.event("error", {"error": str(e)})
-                    raise
 
-            return wrapper
+class LLMTracker:
+    """LLM 追踪器 - 基于 Langfuse"""
 
-        return decorator
+    def __init__(self):
+        self.enabled = langfuse_tracing.enabled
 
-    def trace_generation(
+    def _trace(
         self,
-        name: str = "generation",
+        kind: TraceKind,
+        name: str,
+        template: Optional[Dict] = None,
     ) -> Callable:
-        """生成追踪装饰器"""
+        """追踪装饰器工厂"""
+        build_metadata, end_event, end_metadata = _TRACE_KINDS[kind]
 
         def decorator(func: Callable) -> Callable:
+            if not self.enabled:
+                return func
+
+            trace_name = f"{name}.{func.__name__}" if kind == "llm" else name
+            meta_template = {**(template or {}), "function": func.__name__}
+
+            # 热路径用到的全局名在定义时绑定为默认参数, 调用时按局部变量读取
             @wraps(func)
-            async def wrapper(*args, **kwargs) -> Any:
-                prompt = kwargs.get("prompt", "")
-                model = kwargs.get("model", "")
-                start_time = time.time()
-
-                # 创建追踪
-                trace = langfuse_tracing.create_trace(
-                    name=name,
-                    metadata={
-                        "model": model,
-                        "prompt_length": len(prompt),
-                    },
-                )
+            async def wrapper(
+                *args,
+                _pc=time.perf_counter_ns,
+                _create_trace=langfuse_tracing.create_trace,
+                _current_trace=current_trace_var.get,
+                _fire=_fire_event,
+                **kwargs,
+            ) -> Any:
+                start_ns = _pc()
+                metadata = build_metadata(meta_template, kwargs)
+
+                # 已处于 trace 中时记录为子 span, 不再新建顶层 trace
+                parent = _current_trace()
+                if parent is not None:
+                    trace = parent.span(name=trace_name, metadata=metadata)
+                else:
+                    trace = _create_trace(name=trace_name, metadata=metadata)
+
+                if kind == "llm":
+                    _fire(trace, "function_start", {"args": _REPR.repr(args)[:500]})
 
                 try:
                     result = await func(*args, **kwargs)
-
-                    # 记录生成
-                    trace.event(
-                        "generation_complete",
-                        {
-                            "output_length": len(result) if result else 0,
-                            "duration_ms": (time.time() - start_time) * 1000,
-                        },
-                    )
-
-                    return result
-
                 except Exception as e:
+                    # 尾部采样: 出错时补报所在的 trace (包括未采样请求的 trace)
+                    root = trace if parent is None else parent
+                    if isinstance(root, LocalTrace):
+                        promoted = root.promote()
+                        if parent is None:
+                            trace = promoted
+                        elif isinstance(trace, LocalSpan) and promoted is not root:
+                            span = promoted.span(name=trace_name, metadata=metadata)
+                            # 已排队的 function_start 等事件随后转发到新 span
+                            trace.redirect(span)
+                            trace = span
+                    # 错误事件同步入队, 保证异常抛出前已记录
                     trace.event("error", {"error": str(e)})
+                    if parent is not None:
+                        trace.end()
                     raise
 
+                metadata = end_metadata(result)
+                metadata["duration_ms"] = (_pc() - start_ns) // 1_000_000
+                _fire(trace, end_event, metadata, end=parent is not None)
+
+                return result
+
             return wrapper
 
         return decorator
 
+    def trace_call(
+        self,
+        name: str = "llm_call",
+        provider: str = None,
+        model: str = None,
+    ) -> Callable:
+        """LLM 调用追踪装饰器"""
+        return self._trace("llm", name, {"provider": provider, "model": model})
+
+    def trace_retrieval(
+        self,
+        name: str = "retrieval",
+    ) -> Callable:
+        """检索追踪装饰器"""
+        return self._trace("retrieval", name)
+
+    def trace_generation(
+        self,
+        name: str = "generation",
+    ) -> Callable:
+        """生成追踪装饰器"""
+        return self._trace("generation", name)
+
 
 # ============== 便捷函数 =============
 
@@ -188,17 +206,17 @@ def render_prompt(name: str, variables: Dict[str, str], version: int = None) ->
 # ============== Token 统计 =============
 
 
-def get_token_stats(
+async def get_token_stats(
     start_date: datetime = None,
     end_date: datetime = None,
 ) -> Dict:
     """获取 Token 使用统计 (从 Langfuse)"""
-    return langfuse_tracing.get_token_stats(start_date, end_date)
+    return await langfuse_tracing.get_token_stats(start_date, end_date)
 
 
-def get_generations(name: str = None, limit: int = 100) -> list:
+async def get_generations(name: str = None, limit: int = 100) -> list:
     """获取生成记录"""
-    return langfuse_tracing.get_generations(name, limit)
+    return await langfuse_tracing.get_generations(name, limit)
 
 
 # ============== 上下文管理 =============
@@ -211,12 +229,17 @@ class TraceContext:
         self.name = name
         self.metadata = metadata or {}
         self.trace = None
+        self._token = None
 
     async def __aenter__(self):
         self.trace = langfuse_tracing.create_trace(self.name, self.metadata)
+        self._token = current_trace_var.set(self.trace)
         return self.trace
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self._token is not None:
+            current_trace_var.reset(self._token)
+            self._token = None
         if self.trace:
             self.trace.end()
 
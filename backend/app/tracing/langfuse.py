@@ -1,77 +1,423 @@
 """
 Langfuse 提示词管理与 Token 统计
+
+追踪事件由后台任务批量上报, 调用方不会在每次 trace.end() 时阻塞等待 HTTP。
+短生命周期进程 (脚本、Lambda 等) 退出前必须调用 ``await langfuse_tracing.flush()``
+或 ``langfuse_tracing.shutdown()``, 否则队列中的事件可能丢失。
+设置 ``LANGFUSE_ENFORCE_FLUSH=true`` 可恢复每次 trace 结束即上报的行为。
 """
 
+import asyncio
+import atexit
+import hashlib
+import importlib.util
+import math
 import os
-from typing import Dict, Any, Optional, List
-from datetime import datetime
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from contextvars import Context, ContextVar
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import AsyncIterator, Callable, Dict, Any, Optional, List, Tuple
+from datetime import datetime, timezone
+
+import httpx
+import orjson
+from cachetools import TTLCache
 from loguru import logger
 
+from app.services.prompt import VARIABLE_PATTERN
+
+# 启用开关与依赖检测在导入时计算一次
+_ENABLED = os.getenv("LANGFUSE_ENABLED", "false").lower() == "true"
+_LANGFUSE_INSTALLED = importlib.util.find_spec("langfuse") is not None
+_H2_INSTALLED = importlib.util.find_spec("h2") is not None
+
+# 提示词缓存 (发布后的版本不可变, 5 分钟过期以感知新版本)
+PROMPT_CACHE_SIZE = 256
+PROMPT_CACHE_TTL = 300
+
+# 批量上报参数
+BATCH_SIZE = 256
+FLUSH_INTERVAL_MS = 200
+QUEUE_MAXSIZE = 10_000
+INGESTION_PATH = "/api/public/ingestion"
+
+# 生成记录分页查询 (Langfuse 单页上限 100)
+OBSERVATIONS_PATH = "/api/public/observations"
+GENERATIONS_PAGE_SIZE = 100
+
+# 本地 trace 每类记录的保留上限
+LOCAL_TRACE_MAX = int(os.getenv("LITEKB_TRACE_MAX", "1024"))
+
+# 每次 trace 结束后立即上报 (默认关闭)
+ENFORCE_FLUSH = os.getenv("LANGFUSE_ENFORCE_FLUSH", "false").lower() == "true"
+
+# trace 采样率 (万分比), 10000 表示全量上报
+TRACE_SAMPLE_BPS = int(os.getenv("LITEKB_TRACE_SAMPLE_BPS", "10000"))
+
+# 当前任务/请求所属的 trace
+current_trace_var: ContextVar[Optional[Any]] = ContextVar("current_trace", default=None)
+
+_JSON_HEADERS = {"Content-Type": "application/json"}
+_ORJSON_OPTS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NAIVE_UTC
+
+
+# 事件时间以 time.time_ns() 整数记录, 上报编码时才转换为 ISO 字符串
+_TIME_FIELDS = ("startTime", "endTime")
+
+
+def _ns_to_iso(ns: int) -> str:
+    return datetime.fromtimestamp(ns / 1e9, tz=timezone.utc).isoformat()
+
+
+# 上报事件字段 (camelCase) -> SDK 参数名, 无事件循环时回退到 SDK 使用
+_SDK_FIELDS = {
+    "traceId": "trace_id",
+    "parentObservationId": "parent_observation_id",
+    "userId": "user_id",
+    "startTime": "start_time",
+    "endTime": "end_time",
+}
+
+
+def _sdk_kwargs(body: Dict) -> Dict:
+    kwargs = {}
+    for key, value in body.items():
+        if key in _TIME_FIELDS and isinstance(value, int):
+            value = datetime.fromtimestamp(value / 1e9, tz=timezone.utc)
+        kwargs[_SDK_FIELDS.get(key, key)] = value
+    return kwargs
+
+
+def _emit(ingest: Optional["_IngestQueue"], kind: str, body: Dict, fallback: Callable):
+    """事件进入批量上报队列 (发往全部项目); 无事件循环时经 SDK 发送到主项目"""
+    if ingest is not None and ingest.put_nowait(kind, body):
+        return
+    fallback(**_sdk_kwargs(body))
+
+
+def _content_hash(prompt: Any) -> str:
+    """提示词内容指纹, 内容相同则相同 (chat 提示词按排序后的 JSON 计算)"""
+    if isinstance(prompt, str):
+        data = prompt.encode()
+    else:
+        data = orjson.dumps(prompt, option=orjson.OPT_SORT_KEYS, default=str)
+    return hashlib.md5(data).hexdigest()
+
+
+@lru_cache(maxsize=512)
+def _parse_template(template: str) -> Tuple[Tuple[str, Optional[str], str], ...]:
+    """模板切分为 (前置文本, 变量名, 占位符原文), 同一模板只解析一次"""
+    parts = []
+    pos = 0
+    for match in VARIABLE_PATTERN.finditer(template):
+        parts.append(
+            (
+                template[pos : match.start()],
+                match[match.lastindex],
+                match.group(0),
+            )
+        )
+        pos = match.end()
+    parts.append((template[pos:], None, ""))
+    return tuple(parts)
+
+
+def _sampler(name: str, trace_id: str) -> bool:
+    """头部采样: 返回 False 的 trace 只记录在本地, 不进入上报队列"""
+    if TRACE_SAMPLE_BPS >= 10000:
+        return True
+    return hash((name, trace_id)) % 10000 < TRACE_SAMPLE_BPS
+
+
+def _ingest_client(host: str, public_key: str, secret_key: str) -> httpx.AsyncClient:
+    """批量上报用的连接池, 每个 Langfuse 项目一个"""
+    return httpx.AsyncClient(
+        base_url=host,
+        auth=(public_key or "", secret_key or ""),
+        http2=_H2_INSTALLED,
+        timeout=httpx.Timeout(5.0, connect=2.0),
+        limits=httpx.Limits(max_keepalive_connections=20, max_connections=50),
+    )
+
+
+def _mirror_projects() -> List[Tuple[str, str]]:
+    """LANGFUSE_PROJECTS="pk1:sk1,pk2:sk2" -> 额外上报的项目密钥"""
+    projects = []
+    for item in os.getenv("LANGFUSE_PROJECTS", "").split(","):
+        public_key, _, secret_key = item.strip().partition(":")
+        if public_key and secret_key:
+            projects.append((public_key, secret_key))
+    return projects
+
+
+class _IngestQueue:
+    """Langfuse 事件批量上报队列
+
+    事件先进入 asyncio.Queue, 由单个后台任务按 BATCH_SIZE 或
+    FLUSH_INTERVAL_MS 聚合后一次性 POST 到 /api/public/ingestion。
+    配置了多个 sink 时每批只序列化一次, 并发发送到全部 sink。
+
+    队列、后台任务和 sink 的 AsyncClient 都绑定首次使用它们的事件循环,
+    close() 必须在该循环中调用; close() 后队列会在下次入队时重建。
+    """
+
+    def __init__(self, *sinks: httpx.AsyncClient):
+        self._sinks = sinks
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        atexit.register(self._drain_sync)
+
+    def put_nowait(self, kind: str, body: Dict) -> bool:
+        """入队, 没有运行中的事件循环时返回 False"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=QUEUE_MAXSIZE)
+        if self._worker is None or self._worker.done():
+            # 后台任务使用空上下文, 不继承首个请求的 current_trace_var
+            # (Context().run 兼容 3.10, create_task 的 context 参数需 3.11+)
+            self._worker = Context().run(loop.create_task, self._drain())
+
+        try:
+            self._queue.put_nowait(
+                {
+                    "id": uuid.uuid4().hex,
+                    "type": kind,
+                    "timestamp": time.time_ns(),
+                    "body": body,
+                }
+            )
+        except asyncio.QueueFull:
+            logger.warning("Langfuse ingest queue full, dropping event")
+        return True
+
+    async def _drain(self):
+        """后台任务: 聚合事件后批量上报"""
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = loop.time() + FLUSH_INTERVAL_MS / 1000
+            while len(batch) < BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    # close() 发出的停止标记: 上报当前批次后退出
+                    await self._send(batch)
+                    return
+                batch.append(item)
+            await self._send(batch)
+
+    @staticmethod
+    def _encode(batch: List[Dict]) -> bytes:
+        for item in batch:
+            item["timestamp"] = _ns_to_iso(item["timestamp"])
+            body = item["body"]
+            for key in _TIME_FIELDS:
+                if isinstance(body.get(key), int):
+                    body[key] = _ns_to_iso(body[key])
+        return orjson.dumps({"batch": batch}, option=_ORJSON_OPTS, default=str)
+
+    async def _send(self, batch: List[Dict]):
+        content = self._encode(batch)
+        await asyncio.gather(*[self._post(sink, content) for sink in self._sinks])
+
+    @staticmethod
+    async def _post(sink: httpx.AsyncClient, content: bytes):
+        try:
+            await sink.post(INGESTION_PATH, content=content, headers=_JSON_HEADERS)
+        except Exception as e:
+            logger.warning("Langfuse ingest failed ({}): {}", sink.base_url, e)
+
+    async def flush(self):
+        """立即上报队列中的全部事件"""
+        batch = self._pending()
+        for start in range(0, len(batch), BATCH_SIZE):
+            await self._send(batch[start : start + BATCH_SIZE])
+
+    async def close(self):
+        """停止后台任务 (已聚合的批次先上报), 再上报队列中剩余的事件"""
+        if self._worker is not None and not self._worker.done():
+            await self._queue.put(None)
+            await self._worker
+        self._worker = None
+        await self.flush()
+        self._queue = None
+
+    def shutdown(self):
+        """停止后台任务并同步上报剩余事件"""
+        if self._worker is not None and not self._worker.done():
+            self._worker.cancel()
+        self._drain_sync()
+
+    def _pending(self) -> List[Dict]:
+        items = []
+        while self._queue is not None and not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not None:
+                items.append(item)
+        return items
+
+    def _drain_sync(self):
+        """进程退出时同步上报剩余事件"""
+        batch = self._pending()
+        if not batch:
+            return
+        content = self._encode(batch)
+        for sink in self._sinks:
+            try:
+                httpx.post(
+                    str(sink.base_url.join(INGESTION_PATH)),
+                    content=content,
+                    headers=_JSON_HEADERS,
+                    auth=sink.auth,
+                    timeout=5.0,
+                )
+            except Exception as e:
+                logger.warning("Langfuse ingest failed on exit: {}", e)
+
 
 class LangfuseTracing:
     """Langfuse 追踪 - 原生 API 实现"""
 
     def __init__(self):
         self._client = None
+        self._http: Optional[httpx.AsyncClient] = None
+        self._sync_http: Optional[httpx.Client] = None
+        self._mirrors: List[httpx.AsyncClient] = []
+        self._ingest: Optional[_IngestQueue] = None
         self._enabled = False
+        self._prompt_cache = TTLCache(maxsize=PROMPT_CACHE_SIZE, ttl=PROMPT_CACHE_TTL)
+        self._prompt_lock = threading.RLock()
         self._init_client()
+        # 启用状态只在初始化时确定, 热路径直接读取该标志
+        self._enabled_flag = bool(self._enabled and self._client is not None)
 
     def _init_client(self):
         """初始化 Langfuse 客户端"""
-        self._enabled = os.getenv("LANGFUSE_ENABLED", "false").lower() == "true"
+        self._enabled = _ENABLED
 
         if not self._enabled:
             logger.info("Langfuse disabled")
             return
 
+        if not _LANGFUSE_INSTALLED:
+            logger.warning("langfuse not installed")
+            self._enabled = False
+            return
+
         try:
+            # 仅在启用时导入 SDK, 关闭追踪的进程不承担其导入开销
             from langfuse import Langfuse
-            from langfuse.decorators import langfuse_context
 
+            host = os.getenv("LANGFUSE_HOST", "https://cloud.langfuse.com")
+            public_key = os.getenv("LANGFUSE_PUBLIC_KEY")
+            secret_key = os.getenv("LANGFUSE_SECRET_KEY")
+
+            # SDK 与批量上报各用一个进程内共享的连接池, TCP/TLS 握手只发生一次
+            self._sync_http = httpx.Client(
+                limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+            )
             self._client = Langfuse(
-                public_key=os.getenv("LANGFUSE_PUBLIC_KEY"),
-                secret_key=os.getenv("LANGFUSE_SECRET_KEY"),
-                host=os.getenv("LANGFUSE_HOST", "https://cloud.langfuse.com"),
+                public_key=public_key,
+                secret_key=secret_key,
+                host=host,
+                httpx_client=self._sync_http,
             )
+            self._http = _ingest_client(host, public_key, secret_key)
+            # trace/span/generation 的创建与更新都经批量队列, 额外项目收到完整数据
+            self._mirrors = [
+                _ingest_client(host, pk, sk) for pk, sk in _mirror_projects()
+            ]
+            self._ingest = _IngestQueue(self._http, *self._mirrors)
 
             logger.info("Langfuse initialized")
 
-        except ImportError:
-            logger.warning("langfuse not installed")
-            self._enabled = False
-
         except Exception as e:
-            logger.warning(f"Langfuse init failed: {e}")
+            logger.warning("Langfuse init failed: {}", e)
             self._enabled = False
 
     @property
     def client(self):
         return self._client
 
+    async def flush(self):
+        """上报所有待发送事件"""
+        if self._ingest:
+            await self._ingest.flush()
+        if self._client is not None:
+            await asyncio.to_thread(self._client.flush)
+
+    def shutdown(self):
+        """进程退出前调用"""
+        if self._ingest:
+            self._ingest.shutdown()
+        if self._client is not None:
+            self._client.shutdown()
+
+    async def close(self):
+        """上报剩余事件并关闭连接池 (应用关闭时调用)
+
+        先停止上报队列的后台任务, 再关闭它使用的 AsyncClient。
+        """
+        if self._ingest:
+            await self._ingest.close()
+        if self._client is not None:
+            await asyncio.to_thread(self._client.flush)
+        if self._http is not None:
+            await self._http.aclose()
+        for mirror in self._mirrors:
+            await mirror.aclose()
+        if self._sync_http is not None:
+            self._sync_http.close()
+
     @property
     def enabled(self) -> bool:
-        return self._enabled and self._client is not None
+        return self._enabled_flag
 
     # ============== 提示词管理 ==============
 
     def get_prompt(self, name: str, version: int = None) -> Optional[Dict]:
         """获取提示词"""
-        if not self.enabled:
+        if not self._enabled_flag:
             return None
 
+        with self._prompt_lock:
+            cached = self._prompt_cache.get((name, version))
+        if cached is not None:
+            return cached
+
         try:
             prompt = self._client.get_prompt(
                 name=name,
                 version=version,
             )
-            return {
+            result = {
                 "name": prompt.name,
                 "prompt": prompt.prompt,
                 "version": prompt.version,
                 "config": prompt.config,
+                "version_hash": _content_hash(prompt.prompt),
             }
+            with self._prompt_lock:
+                self._prompt_cache[(name, version)] = result
+            return result
         except Exception as e:
-            logger.warning(f"Get prompt failed: {e}")
+            logger.warning("Get prompt failed: {}", e)
             return None
 
     def create_prompt(
@@ -82,7 +428,7 @@ class LangfuseTracing:
         config: Dict = None,
     ) -> Optional[Dict]:
         """创建提示词"""
-        if not self.enabled:
+        if not self._enabled_flag:
             return None
 
         try:
@@ -92,13 +438,14 @@ class LangfuseTracing:
                 version=version,
                 config=config or {},
             )
+            self._invalidate_prompt(name)
             return {
                 "name": langfuse_prompt.name,
                 "prompt": langfuse_prompt.prompt,
                 "version": langfuse_prompt.version,
             }
         except Exception as e:
-            logger.warning(f"Create prompt failed: {e}")
+            logger.warning("Create prompt failed: {}", e)
             return None
 
     def update_prompt(
@@ -108,7 +455,7 @@ class LangfuseTracing:
         config: Dict = None,
     ) -> Optional[Dict]:
         """更新提示词"""
-        if not self.enabled:
+        if not self._enabled_flag:
             return None
 
         try:
@@ -118,41 +465,50 @@ class LangfuseTracing:
                 prompt=prompt,
                 config=config or {},
             )
+            self._invalidate_prompt(name)
             return {
                 "name": langfuse_prompt.name,
                 "prompt": langfuse_prompt.prompt,
                 "version": langfuse_prompt.version,
             }
         except Exception as e:
-            logger.warning(f"Update prompt failed: {e}")
+            logger.warning("Update prompt failed: {}", e)
             return None
 
+    def _invalidate_prompt(self, name: str):
+        """提示词发布新版本后清除其缓存"""
+        with self._prompt_lock:
+            for key in [k for k in self._prompt_cache if k[0] == name]:
+                self._prompt_cache.pop(key, None)
+
     def list_prompts(self) -> List[Dict]:
         """列出所有提示词"""
-        if not self.enabled:
+        if not self._enabled_flag:
             return []
 
         try:
-            prompts = self._client.get_prompts()
+            prompts = self._client.get_prompts().data
+            # 同一批记录的 created_at 类型一致, 只判断一次
+            to_text = (
+                datetime.isoformat
+                if prompts and isinstance(prompts[0].created_at, datetime)
+                else str
+            )
             return [
                 {
                     "name": p.name,
                     "version": p.version,
-                    "created_at": (
-                        p.created_at.isoformat()
-                        if hasattr(p.created_at, "isoformat")
-                        else str(p.created_at)
-                    ),
+                    "created_at": to_text(p.created_at),
                 }
-                for p in prompts.data
+                for p in prompts
             ]
         except Exception as e:
-            logger.warning(f"List prompts failed: {e}")
+            logger.warning("List prompts failed: {}", e)
             return []
 
     def get_prompt_versions(self, name: str) -> List[Dict]:
         """获取提示词版本历史"""
-        if not self.enabled:
+        if not self._enabled_flag:
             return []
 
         try:
@@ -170,7 +526,7 @@ class LangfuseTracing:
 
             return versions
         except Exception as e:
-            logger.warning(f"Get versions failed: {e}")
+            logger.warning("Get versions failed: {}", e)
             return []
 
     def render_prompt(
@@ -183,15 +539,14 @@ class LangfuseTracing:
         prompt_data = self.get_prompt(name, version)
         if not prompt_data:
             return ""
+        if not variables:
+            return prompt_data["prompt"]
 
-        rendered = prompt_data["prompt"]
-
-        # 替换变量
-        for key, value in variables.items():
-            rendered = rendered.replace(f"{{{{{key}}}}}", str(value))
-            rendered = rendered.replace(f"${{{key}}}", str(value))
-
-        return rendered
+        # 未提供的变量保留占位符原文
+        return "".join(
+            literal + (str(variables[var]) if var in variables else raw)
+            for literal, var, raw in _parse_template(prompt_data["prompt"])
+        )
 
     def delete_prompt(self, name: str, version: int) -> bool:
         """删除提示词版本"""
@@ -208,25 +563,44 @@ class LangfuseTracing:
         user_id: str = None,
     ):
         """创建追踪"""
-        if not self.enabled:
+        if not self._enabled_flag:
             return LocalTrace(name, metadata)
 
-        try:
-            from langfuse import LangfuseTrace
+        trace_id = uuid.uuid4().hex
+        if not _sampler(name, trace_id):
+            # 未采样: 出错时可通过 promote() 补报
+            trace = LocalTrace(name, metadata)
+            trace._promote = lambda local: self._promote_trace(local, trace_id, user_id)
+            return trace
 
-            trace = self._client.trace(
-                name=name,
-                metadata=metadata,
-                user_id=user_id,
-            )
-            return LangfuseTraceObj(trace)
+        try:
+            return self._start_trace(trace_id, name, metadata, user_id)
         except Exception as e:
-            logger.warning(f"Create trace failed: {e}")
+            logger.warning("Create trace failed: {}", e)
             return LocalTrace(name, metadata)
 
+    def _start_trace(
+        self, trace_id: str, name: str, metadata: Dict = None, user_id: str = None
+    ) -> "LangfuseTraceObj":
+        body = {"id": trace_id, "name": name, "metadata": metadata, "userId": user_id}
+        _emit(self._ingest, "trace-create", body, self._client.trace)
+        return LangfuseTraceObj(self._client, self._ingest, trace_id)
+
+    def _promote_trace(self, local: "LocalTrace", trace_id: str, user_id: str = None):
+        """尾部采样: 将未采样的本地 trace 补报到 Langfuse, 并回放已缓存的事件"""
+        try:
+            trace = self._start_trace(trace_id, local.name, local.metadata, user_id)
+        except Exception as e:
+            logger.warning("Promote trace failed: {}", e)
+            return local
+
+        for event in local.events:
+            trace.event(event["name"], event["metadata"])
+        return trace
+
     def create_generation(
         self,
-        trace,
+        trace: Optional[Any],
         name: str,
         prompt: str,
         model: str,
@@ -234,14 +608,18 @@ class LangfuseTracing:
         usage: Dict = None,
         metadata: Dict = None,
     ):
-        """创建生成记录 (含 Token 统计)"""
-        if not self.enabled:
+        """创建生成记录 (含 Token 统计), trace 为 None 时挂到当前请求的 trace"""
+        trace = self._resolve_parent(trace)
+        if not self._enabled_flag or trace is None:
             return LocalGeneration(name, prompt, model, completion)
+        if isinstance(trace, LocalTrace):
+            # 未采样的 trace: 子记录留在本地缓冲
+            return trace.generation(
+                name=name, input=prompt, model=model, output=completion
+            )
 
         try:
-            from langfuse import LangfuseGeneration
-
-            generation = trace.generation(
+            return trace.generation(
                 name=name,
                 input=prompt,
                 model=model,
@@ -249,242 +627,392 @@ class LangfuseTracing:
                 metadata=metadata,
                 usage=usage,
             )
-            return LangfuseGenerationObj(generation, usage)
         except Exception as e:
-            logger.warning(f"Create generation failed: {e}")
+            logger.warning("Create generation failed: {}", e)
             return LocalGeneration(name, prompt, model, completion)
 
     def create_span(
         self,
-        trace,
+        trace: Optional[Any],
         name: str,
         metadata: Dict = None,
     ):
-        """创建跨度"""
-        if not self.enabled:
+        """创建跨度, trace 为 None 时挂到当前请求的 trace"""
+        trace = self._resolve_parent(trace)
+        if not self._enabled_flag or trace is None:
             return LocalSpan(name, metadata)
+        if isinstance(trace, LocalTrace):
+            return trace.span(name=name, metadata=metadata)
 
         try:
-            from langfuse import LangfuseSpan
-
-            span = trace.span(
-                name=name,
-                metadata=metadata,
-            )
-            return LangfuseSpanObj(span)
+            return trace.span(name=name, metadata=metadata)
         except Exception as e:
-            logger.warning(f"Create span failed: {e}")
+            logger.warning("Create span failed: {}", e)
             return LocalSpan(name, metadata)
 
+    @staticmethod
+    def _resolve_parent(trace: Optional[Any]):
+        """未显式传入时取 current_trace_var"""
+        if trace is None:
+            trace = current_trace_var.get()
+        return trace
+
     # ============== Token & Cost 统计 ==============
 
-    def get_generations(
+    async def iter_generations(
         self,
         name: str = None,
         limit: int = 100,
-    ) -> List[Dict]:
-        """获取生成记录 (Token 统计)"""
-        if not self.enabled:
-            return []
+    ) -> AsyncIterator[Dict]:
+        """逐条产出生成记录, 逐页请求, 解析当前页时预取下一页
 
-        try:
-            from datetime import timedelta
+        请求失败时抛出异常, 由调用方处理。
+        """
+        if not self._enabled_flag:
+            return
 
-            generations = self._client.generations(
-                name=name,
-                limit=limit,
+        pages = math.ceil(limit / GENERATIONS_PAGE_SIZE)
+        page_size = min(limit, GENERATIONS_PAGE_SIZE)
+        params = {"type": "GENERATION", "limit": page_size}
+        if name:
+            params["name"] = name
+
+        def fetch(page: int) -> asyncio.Task:
+            return asyncio.ensure_future(
+                self._http.get(OBSERVATIONS_PATH, params={**params, "page": page})
             )
 
-            return [
-                {
-                    "name": g.name,
-                    "model": g.model,
-                    "input_tokens": g.usage.input_tokens if g.usage else 0,
-                    "output_tokens": g.usage.output_tokens if g.usage else 0,
-                    "total_tokens": (
-                        (g.usage.input_tokens + g.usage.output_tokens) if g.usage else 0
-                    ),
-                    "cost": g.usage.calculated_cost if g.usage else 0,
-                    "created_at": (
-                        g.created_at.isoformat()
-                        if hasattr(g.created_at, "isoformat")
-                        else str(g.created_at)
-                    ),
-                }
-                for g in generations.data
-            ]
+        remaining = limit
+        pending = fetch(1)
+        try:
+            for page in range(1, pages + 1):
+                response = await pending
+                pending = None
+                response.raise_for_status()
+                data = response.json().get("data", [])
+                # 未取满且未到末页时预取下一页, 至多一页在途
+                if page < pages and len(data) >= page_size:
+                    pending = fetch(page + 1)
+                for g in data[:remaining]:
+                    yield _generation_row(g)
+                remaining -= min(len(data), remaining)
+                if remaining <= 0 or pending is None:
+                    break
+        finally:
+            # 调用方提前结束迭代时取消在途请求
+            if pending is not None:
+                pending.cancel()
+
+    async def get_generations(
+        self,
+        name: str = None,
+        limit: int = 100,
+    ) -> List[Dict]:
+        """获取生成记录 (Token 统计)"""
+        try:
+            return [g async for g in self.iter_generations(name, limit)]
         except Exception as e:
-            logger.warning(f"Get generations failed: {e}")
+            logger.warning("Get generations failed: {}", e)
             return []
 
-    def get_token_stats(
+    async def get_token_stats(
         self,
         start_date: datetime = None,
         end_date: datetime = None,
     ) -> Dict:
         """获取 Token 使用统计"""
-        if not self.enabled:
-            return {
-                "total_input_tokens": 0,
-                "total_output_tokens": 0,
-                "total_tokens": 0,
-                "total_cost": 0,
-                "by_model": {},
-                "by_day": {},
-            }
+        if not self._enabled_flag:
+            return _empty_token_stats()
 
         try:
-            generations = self.get_generations(limit=1000)
-
-            stats = {
-                "total_input_tokens": 0,
-                "total_output_tokens": 0,
-                "total_tokens": 0,
-                "total_cost": 0,
-                "by_model": {},
-                "by_day": {},
-            }
+            total_input = total_output = 0
+            total_cost = 0
+            by_model = defaultdict(
+                lambda: {"input_tokens": 0, "output_tokens": 0, "cost": 0}
+            )
+            by_day = defaultdict(int)
 
-            for g in generations:
-                input_t = g.get("input_tokens", 0)
-                output_t = g.get("output_tokens", 0)
-                cost = g.get("cost", 0)
-                model = g.get("model", "unknown")
-                created = g.get("created_at", "")
-
-                # 更新总计
-                stats["total_input_tokens"] += input_t
-                stats["total_output_tokens"] += output_t
-                stats["total_tokens"] += input_t + output_t
-                stats["total_cost"] += cost
-
-                # 按模型统计
-                if model not in stats["by_model"]:
-                    stats["by_model"][model] = {
-                        "input_tokens": 0,
-                        "output_tokens": 0,
-                        "cost": 0,
-                    }
-                stats["by_model"][model]["input_tokens"] += input_t
-                stats["by_model"][model]["output_tokens"] += output_t
-                stats["by_model"][model]["cost"] += cost
+            async for g in self.iter_generations(limit=1000):
+                input_t, output_t, cost = (
+                    g["input_tokens"],
+                    g["output_tokens"],
+                    g["cost"],
+                )
 
-            return stats
+                total_input += input_t
+                total_output += output_t
+                total_cost += cost
+
+                model_stats = by_model[g["model"] or "unknown"]
+                model_stats["input_tokens"] += input_t
+                model_stats["output_tokens"] += output_t
+                model_stats["cost"] += cost
+
+                # created_at 为 ISO 时间, 前 10 位即日期
+                by_day[str(g["created_at"])[:10]] += input_t + output_t
 
-        except Exception as e:
-            logger.warning(f"Get token stats failed: {e}")
             return {
-                "total_input_tokens": 0,
-                "total_output_tokens": 0,
-                "total_tokens": 0,
-                "total_cost": 0,
-                "by_model": {},
-                "by_day": {},
+                "total_input_tokens": total_input,
+                "total_output_tokens": total_output,
+                "total_tokens": total_input + total_output,
+                "total_cost": total_cost,
+                "by_model": dict(by_model),
+                "by_day": dict(by_day),
             }
 
+        except Exception as e:
+            logger.warning("Get token stats failed: {}", e)
+            return _empty_token_stats()
+
+
+def _empty_token_stats() -> Dict:
+    return {
+        "total_input_tokens": 0,
+        "total_output_tokens": 0,
+        "total_tokens": 0,
+        "total_cost": 0,
+        "by_model": {},
+        "by_day": {},
+    }
+
+
+def _generation_row(g: Dict) -> Dict:
+    """Langfuse observation -> 生成记录"""
+    usage = g.get("usage") or {}
+    input_tokens = usage.get("input") or g.get("promptTokens") or 0
+    output_tokens = usage.get("output") or g.get("completionTokens") or 0
+    return {
+        "name": g.get("name"),
+        "model": g.get("model"),
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "total_tokens": input_tokens + output_tokens,
+        "cost": g.get("calculatedTotalCost") or 0,
+        "created_at": g.get("startTime") or g.get("createdAt") or "",
+    }
+
 
 # ============== 本地回退类 ==============
 
 
+def _ring_buffer() -> deque:
+    return deque(maxlen=LOCAL_TRACE_MAX)
+
+
+@dataclass(slots=True)
 class LocalTrace:
     """本地追踪"""
 
-    def __init__(self, name: str, metadata: Dict = None):
-        self.name = name
-        self.metadata = metadata or {}
-        self.generations = []
-        self.spans = []
-        self.events = []
+    name: str
+    metadata: Optional[Dict] = field(default_factory=dict)
+    start_time: int = field(default_factory=time.time_ns, init=False)
+    generations: deque = field(default_factory=_ring_buffer, init=False)
+    spans: deque = field(default_factory=_ring_buffer, init=False)
+    events: deque = field(default_factory=_ring_buffer, init=False)
+    _dropped: int = field(default=0, init=False)
+    _promote: Optional[Callable] = field(default=None, init=False, repr=False)
+    # 补报后得到的 trace, 之后的记录 (如已排队的事件) 转发过去
+    _promoted: Optional[Any] = field(default=None, init=False, repr=False)
+
+    def __post_init__(self):
+        if self.metadata is None:
+            self.metadata = {}
+
+    def _append(self, buffer: deque, item):
+        if len(buffer) == buffer.maxlen:
+            self._dropped += 1
+        buffer.append(item)
 
     def generation(self, **kwargs):
         gen = LocalGeneration(
             name=kwargs.get("name", "gen"),
             prompt=kwargs.get("input", ""),
             model=kwargs.get("model", ""),
+            completion=kwargs.get("output"),
         )
-        self.generations.append(gen)
+        self._append(self.generations, gen)
         return gen
 
     def span(self, **kwargs):
-        span = LocalSpan(kwargs.get("name", "span"))
-        self.spans.append(span)
+        if self._promoted is not None:
+            return self._promoted.span(**kwargs)
+        span = LocalSpan(kwargs.get("name", "span"), kwargs.get("metadata"))
+        self._append(self.spans, span)
         return span
 
     def event(self, name: str, metadata: Dict = None):
-        self.events.append({"name": name, "metadata": metadata})
+        if self._promoted is not None:
+            self._promoted.event(name, metadata)
+            return
+        self._append(
+            self.events,
+            {"name": name, "metadata": metadata, "timestamp": time.time_ns()},
+        )
 
     def end(self, metadata: Dict = None):
-        pass
-
-
+        if self._promoted is not None:
+            self._promoted.end(metadata)
+
+    def promote(self):
+        """采样丢弃的 trace 出错时调用, 返回可上报的 trace (不可补报时返回自身)
+
+        可重复调用; 补报后本对象上的后续记录转发到补报的 trace。
+        """
+        if self._promoted is not None:
+            return self._promoted
+        if self._promote is None:
+            return self
+        promoted = self._promote(self)
+        if promoted is not self:
+            self._promoted = promoted
+        return promoted
+
+    def stats(self) -> Dict:
+        """缓冲区统计 (含被淘汰的记录数)"""
+        return {
+            "generations": len(self.generations),
+            "spans": len(self.spans),
+            "events": len(self.events),
+            "dropped": self._dropped,
+        }
+
+
+@dataclass(slots=True)
 class LocalGeneration:
     """本地生成"""
 
-    def __init__(self, name: str, prompt: str, model: str, completion: str = None):
-        self.name = name
-        self.prompt = prompt
-        self.model = model
-        self.completion = completion
-        self.usage = {}
+    name: str
+    prompt: str
+    model: str
+    completion: Optional[str] = None
+    usage: Dict = field(default_factory=dict, init=False)
 
     def end(self, **kwargs):
         self.usage = kwargs.get("usage", {})
 
 
+@dataclass(slots=True)
 class LocalSpan:
     """本地跨度"""
 
-    def __init__(self, name: str, metadata: Dict = None):
-        self.name = name
-        self.metadata = metadata or {}
-        self.events = []
+    name: str
+    metadata: Optional[Dict] = field(default_factory=dict)
+    events: deque = field(default_factory=_ring_buffer, init=False)
+    _dropped: int = field(default=0, init=False)
+    _target: Optional[Any] = field(default=None, init=False, repr=False)
+
+    def __post_init__(self):
+        if self.metadata is None:
+            self.metadata = {}
+
+    def redirect(self, target):
+        """所在 trace 补报后调用: 回放已记录的事件, 之后的记录转发到 target"""
+        for event in self.events:
+            target.event(event["name"], event["metadata"])
+        self._target = target
 
     def event(self, name: str, metadata: Dict = None):
-        self.events.append({"name": name, "metadata": metadata})
+        if self._target is not None:
+            self._target.event(name, metadata)
+            return
+        if len(self.events) == self.events.maxlen:
+            self._dropped += 1
+        self.events.append(
+            {"name": name, "metadata": metadata, "timestamp": time.time_ns()}
+        )
+
+    def stats(self) -> Dict:
+        """缓冲区统计 (含被淘汰的记录数)"""
+        return {"events": len(self.events), "dropped": self._dropped}
 
     def end(self, **kwargs):
-        pass
+        if self._target is not None:
+            self._target.end(**kwargs)
 
 
 # ============== Langfuse 包装类 ==============
 
 
 class LangfuseTraceObj:
-    """Langfuse 追踪包装"""
+    """Langfuse 追踪包装
 
-    def __init__(self, trace):
-        self._trace = trace
+    创建与更新都作为 ingestion 事件进入批量队列, 只在没有事件循环时回退到 SDK。
+    """
 
-    def generation(self, **kwargs):
-        from langfuse import LangfuseGeneration
+    def __init__(self, client, ingest: Optional[_IngestQueue], trace_id: str):
+        self._client = client
+        self._ingest = ingest
+        self.id = trace_id
 
+    def generation(self, **kwargs):
+        usage = kwargs.get("usage")
+        body = {
+            "id": uuid.uuid4().hex,
+            "traceId": self.id,
+            "startTime": time.time_ns(),
+            **kwargs,
+        }
+        _emit(self._ingest, "generation-create", body, self._client.generation)
         return LangfuseGenerationObj(
-            self._trace.generation(**kwargs), kwargs.get("usage")
+            self._client, self._ingest, body["id"], self.id, usage
         )
 
     def span(self, **kwargs):
-        from langfuse import LangfuseSpan
-
-        return LangfuseSpanObj(self._trace.span(**kwargs))
+        body = {
+            "id": uuid.uuid4().hex,
+            "traceId": self.id,
+            "startTime": time.time_ns(),
+            **kwargs,
+        }
+        _emit(self._ingest, "span-create", body, self._client.span)
+        return LangfuseSpanObj(self._client, self._ingest, body["id"], self.id)
 
     def event(self, name: str, metadata: Dict = None):
-        self._trace.event(name=name, metadata=metadata)
+        body = {
+            "id": uuid.uuid4().hex,
+            "traceId": self.id,
+            "name": name,
+            "metadata": metadata,
+            "startTime": time.time_ns(),
+        }
+        _emit(self._ingest, "event-create", body, self._client.event)
 
     def end(self, metadata: Dict = None):
-        self._trace.end(metadata=metadata)
+        body = {"id": self.id, "metadata": metadata}
+        _emit(self._ingest, "trace-create", body, self._client.trace)
+        if ENFORCE_FLUSH and self._ingest is not None:
+            try:
+                asyncio.get_running_loop().create_task(self._ingest.flush())
+            except RuntimeError:
+                pass
 
 
 class LangfuseGenerationObj:
     """Langfuse 生成包装"""
 
-    def __init__(self, generation, usage: Dict = None):
-        self._gen = generation
+    def __init__(
+        self,
+        client,
+        ingest: Optional[_IngestQueue],
+        generation_id: str,
+        trace_id: str,
+        usage: Dict = None,
+    ):
+        self._client = client
+        self._ingest = ingest
+        self.id = generation_id
+        self.trace_id = trace_id
         self._usage = usage or {}
 
     def end(self, **kwargs):
-        output = kwargs.get("output")
-        usage = kwargs.get("usage") or self._usage
-        self._gen.end(output=output, usage=usage)
+        body = {
+            "id": self.id,
+            "traceId": self.trace_id,
+            "output": kwargs.get("output"),
+            "usage": kwargs.get("usage") or self._usage,
+            "endTime": time.time_ns(),
+        }
+        _emit(self._ingest, "generation-update", body, self._client.generation)
 
     @property
     def usage(self):
@@ -494,14 +1022,33 @@ class LangfuseGenerationObj:
 class LangfuseSpanObj:
     """Langfuse 跨度包装"""
 
-    def __init__(self, span):
-        self._span = span
+    def __init__(
+        self, client, ingest: Optional[_IngestQueue], span_id: str, trace_id: str
+    ):
+        self._client = client
+        self._ingest = ingest
+        self.id = span_id
+        self.trace_id = trace_id
 
     def event(self, name: str, metadata: Dict = None):
-        self._span.event(name=name, metadata=metadata)
+        body = {
+            "id": uuid.uuid4().hex,
+            "traceId": self.trace_id,
+            "parentObservationId": self.id,
+            "name": name,
+            "metadata": metadata,
+            "startTime": time.time_ns(),
+        }
+        _emit(self._ingest, "event-create", body, self._client.event)
 
     def end(self, **kwargs):
-        self._span.end(**kwargs)
+        body = {
+            "id": self.id,
+            "traceId": self.trace_id,
+            "endTime": time.time_ns(),
+            **kwargs,
+        }
+        _emit(self._ingest, "span-update", body, self._client.span)
 
 
 # 全局实例
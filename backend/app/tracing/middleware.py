@@ -2,7 +2,9 @@
 自动追踪中间件
 """
 
-from typing import Callable, Dict, Optional
+import asyncio
+import contextvars
+from typing import Any, Callable, Dict, List, Optional, Tuple
 from fastapi import Request
 from fastapi.responses import JSONResponse
 from starlette.middleware.base import BaseHTTPMiddleware
@@ -10,12 +12,128 @@ import time
 from loguru import logger
 
 try:
-    from app.tracing.langfuse import langfuse
+    from app.tracing.langfuse import (
+        LocalTrace,
+        current_trace_var,
+        langfuse_tracing as langfuse,
+    )
 
     LANGFUSE_AVAILABLE = True
 except ImportError:
     LANGFUSE_AVAILABLE = False
     langfuse = None
+    current_trace_var = None
+    LocalTrace = None
+
+# 写入 trace 的用户内容长度上限
+_MAX_QUERY = 500
+
+# 允许写入 trace 的查询参数
+TRACED_QUERY_PARAMS = frozenset(
+    {"q", "mode", "kb_id", "limit", "skip", "org_id", "days"}
+)
+
+
+def _trunc(s: str, n: int = _MAX_QUERY) -> str:
+    return s if len(s) <= n else s[:n]
+
+
+# 事件批量提交参数
+EVENT_BATCH_SIZE = 50
+EVENT_FLUSH_TIMEOUT = 5.0
+EVENT_QUEUE_MAXSIZE = 10_000
+
+
+class _EventBatcher:
+    """请求追踪事件缓冲
+
+    dispatch 只负责入队, 由单个后台任务按 EVENT_BATCH_SIZE 或
+    EVENT_FLUSH_TIMEOUT 聚合后调用 trace.event / trace.end。
+    """
+
+    def __init__(self):
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    def put(self, trace, kind: str, payload: Any):
+        """入队 (kind 为 "event" 或 "end"), 队列满时丢弃"""
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=EVENT_QUEUE_MAXSIZE)
+        if self._worker is None or self._worker.done():
+            # 后台任务使用空上下文, 不继承首个请求的 current_trace_var
+            # Context().run 兼容 3.10 (create_task 的 context 参数需 3.11+)
+            self._worker = contextvars.Context().run(
+                asyncio.get_running_loop().create_task, self._flush_loop()
+            )
+
+        try:
+            self._queue.put_nowait((trace, kind, payload))
+        except asyncio.QueueFull:
+            logger.warning("Tracing event queue full, dropping event")
+
+    async def _flush_loop(self):
+        """后台任务: 聚合事件后提交"""
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = loop.time() + EVENT_FLUSH_TIMEOUT
+            while len(batch) < EVENT_BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    # close() 发出的停止标记: 提交当前批次后退出
+                    self._submit(batch)
+                    return
+                batch.append(item)
+            self._submit(batch)
+
+    def flush(self):
+        """立即提交队列中的全部事件"""
+        batch = []
+        while self._queue is not None and not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not None:
+                batch.append(item)
+        if batch:
+            self._submit(batch)
+
+    async def close(self):
+        """停止后台任务并提交剩余事件 (应用关闭时调用)"""
+        if self._worker is not None and not self._worker.done():
+            # 用停止标记代替 cancel: 后台任务先提交已聚合的批次
+            await self._queue.put(None)
+            await self._worker
+        self._worker = None
+        self.flush()
+
+    @staticmethod
+    def _submit(batch: List[Tuple[Any, str, Any]]):
+        # 按 trace 分组, 组内保持入队顺序
+        grouped: Dict[int, List[Tuple[Any, str, Any]]] = {}
+        for item in batch:
+            grouped.setdefault(id(item[0]), []).append(item)
+
+        for items in grouped.values():
+            for trace, kind, payload in items:
+                try:
+                    if kind == "event":
+                        trace.event(*payload)
+                    else:
+                        trace.end(payload)
+                except Exception as e:
+                    logger.warning("Tracing event submit failed: {}", e)
+
+
+# 全局实例 (应用关闭时由 lifespan 调用 close)
+event_batcher = _EventBatcher()
 
 
 class TracingMiddleware(BaseHTTPMiddleware):
@@ -29,43 +147,55 @@ class TracingMiddleware(BaseHTTPMiddleware):
         "/favicon.ico",
         "/static",
     }
+    EXCLUDE_PREFIXES = ("/static/", "/health", "/ready", "/metrics")
 
     def __init__(self, app, trace_all: bool = False):
         super().__init__(app)
         self.trace_all = trace_all
+        self.batcher = event_batcher
 
     async def dispatch(self, request: Request, call_next: Callable):
-        # 排除不需要追踪的路径
-        if request.url.path in self.EXCLUDE_PATHS:
-            return await call_next(request)
-
-        # 只追踪 API 请求
-        if not request.url.path.startswith("/api/"):
+        # 只追踪 API 请求, 排除不需要追踪的路径
+        path = request.scope["path"]
+        if (
+            path in self.EXCLUDE_PATHS
+            or path.startswith(self.EXCLUDE_PREFIXES)
+            or not path.startswith("/api/")
+        ):
             return await call_next(request)
 
         start_time = time.time()
         trace = None
+        token = None
 
         try:
             # 创建追踪
             if LANGFUSE_AVAILABLE and langfuse.enabled:
                 trace = langfuse.create_trace(
-                    name=f"{request.method} {request.url.path}",
+                    name=f"{request.method} {path}",
                     metadata={
                         "method": request.method,
-                        "path": request.url.path,
-                        "query_params": dict(request.query_params),
+                        "path": path,
+                        "query_params": {
+                            k: _trunc(v)
+                            for k, v in request.query_params.items()
+                            if k in TRACED_QUERY_PARAMS
+                        },
                         "user_agent": request.headers.get("user-agent"),
                         "ip": request.client.host if request.client else None,
                     },
                 )
+                # 本请求内的 span / generation 默认挂到该 trace
+                token = current_trace_var.set(trace)
 
                 # 记录请求
-                trace.event(
-                    "request_received",
-                    {
-                        "body_size": request.headers.get("content-length", 0),
-                    },
+                self.batcher.put(
+                    trace,
+                    "event",
+                    (
+                        "request_received",
+                        {"body_size": request.headers.get("content-length", 0)},
+                    ),
                 )
 
             # 执行请求
@@ -75,27 +205,24 @@ class TracingMiddleware(BaseHTTPMiddleware):
 
             # 记录响应
             if LANGFUSE_AVAILABLE and langfuse.enabled:
-                trace.event(
-                    "response_sent",
-                    {
-                        "status_code": response.status_code,
-                        "duration_ms": duration,
-                    },
-                )
+                summary = {
+                    "status_code": response.status_code,
+                    "duration_ms": duration,
+                }
+                if response.status_code >= 500 and isinstance(trace, LocalTrace):
+                    trace = trace.promote()
+                self.batcher.put(trace, "event", ("response_sent", summary))
 
                 # 结束追踪
-                trace.end(
-                    {
-                        "status_code": response.status_code,
-                        "duration_ms": duration,
-                    }
-                )
+                self.batcher.put(trace, "end", summary)
 
             # 记录慢请求
             if duration > 5000:  # > 5s
                 logger.warning(
-                    f"[Slow Request] {request.method} {request.url.path}: "
-                    f"{duration:.2f}ms"
+                    "[Slow Request] {} {}: {:.2f}ms",
+                    request.method,
+                    path,
+                    duration,
                 )
 
             return response
@@ -104,22 +231,27 @@ class TracingMiddleware(BaseHTTPMiddleware):
             duration = (time.time() - start_time) * 1000
 
             if LANGFUSE_AVAILABLE and langfuse.enabled and trace:
-                trace.event(
-                    "error",
-                    {
-                        "error": str(e),
-                        "duration_ms": duration,
-                    },
+                # 尾部采样: 出错的请求总是上报, 已排队的事件随之转发
+                if isinstance(trace, LocalTrace):
+                    trace = trace.promote()
+                self.batcher.put(
+                    trace,
+                    "event",
+                    ("error", {"error": str(e), "duration_ms": duration}),
                 )
-                trace.end({"error": True})
+                self.batcher.put(trace, "end", {"error": True})
 
-            logger.error(f"[Request Error] {request.method} {request.url.path}: {e}")
+            logger.error("[Request Error] {} {}: {}", request.method, path, e)
 
             return JSONResponse(
                 status_code=500,
                 content={"detail": "Internal server error"},
             )
 
+        finally:
+            if token is not None:
+                current_trace_var.reset(token)
+
 
 # RAG 追踪集成
 class RAGTracing:
@@ -151,7 +283,7 @@ class RAGTracing:
                 name=f"rag.query.{mode}",
                 metadata={
                     "kb_id": kb_id,
-                    "query": query[:500],
+                    "query": _trunc(query),
                     "mode": mode,
                 },
             ) as trace:
@@ -181,7 +313,7 @@ class RAGTracing:
                 return results, trace, generation_span
 
         except Exception as e:
-            logger.error(f"RAG tracing failed: {e}")
+            logger.error("RAG tracing failed: {}", e)
             return None, None, None
 
     def end_generation(
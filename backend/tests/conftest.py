@@ -0,0 +1,84 @@
+"""
+测试公共 fixture
+"""
+
+import os
+from unittest.mock import AsyncMock
+
+import pytest
+import pytest_asyncio
+from httpx import ASGITransport, AsyncClient
+
+# 须在导入 app.* 之前设置 (降低 bcrypt 轮数等)
+os.environ.setdefault("TESTING", "1")
+
+
+@pytest.fixture(scope="session", autouse=True)
+def _fake_services():
+    """默认用进程内替身代替外部服务: Redis 走本地缓存, LLM 返回固定回复
+
+    需要真实服务的用例标记为 integration, 默认不运行
+    """
+    from app.services.cache import cache
+
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(cache, "_enabled", False)
+        mp.setattr(cache, "_redis", None)
+        try:
+            from app.services import rag
+        except Exception:  # rag 模块导入失败时对话接口本身不可用, 无需替换
+            rag = None
+        if rag is not None:
+            mp.setattr(rag.LLMClient, "chat", AsyncMock(return_value="ok"))
+        yield
+
+
+@pytest.fixture(scope="session")
+def app():
+    """应用实例 (整个测试会话只导入一次)"""
+    from app.main import app
+
+    return app
+
+
+@pytest_asyncio.fixture(scope="session", loop_scope="session")
+async def aclient(app):
+    """共享异步测试客户端, 应用启动/关闭只执行一次"""
+    async with app.router.lifespan_context(app):
+        async with AsyncClient(
+            transport=ASGITransport(app=app), base_url="http://test"
+        ) as c:
+            yield c
+
+
+@pytest.fixture(scope="session")
+def auth_headers(app):
+    """会话级认证头: 直接写入测试用户并签发 JWT, 不走注册/登录接口"""
+    import uuid
+
+    from app.db.factory import db
+    from app.main import create_access_token
+
+    user_id = str(uuid.uuid4())
+    db.create_user(
+        user_id,
+        {
+            "username": f"session_{uuid.uuid4().hex[:8]}",
+            # 不可用于登录的占位哈希, 省去 bcrypt 计算
+            "hashed_password": "!",
+        },
+    )
+    token = create_access_token(data={"sub": user_id})
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.fixture(scope="session", autouse=True)
+def _warm_embeddings():
+    """使用本地嵌入模型时, 在会话开始前预加载, 避免首个用例承担冷启动"""
+    from app.config import settings
+
+    if settings.embedding_provider != "sentence-transformers":
+        return
+    from app.services.local_embedding import get_embedding_model
+
+    get_embedding_model().encode(["warmup"])
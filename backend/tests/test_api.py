@@ -3,36 +3,28 @@ API 测试
 """
 
 import pytest
+import pytest_asyncio
 from unittest.mock import Mock, patch, AsyncMock
-from fastapi.testclient import TestClient
-import sys
-import os
 
-sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# 与会话级 aclient 共用同一个事件循环
+pytestmark = pytest.mark.asyncio(loop_scope="session")
 
 
 class TestAPIEndpoints:
     """API 端点测试"""
 
-    @pytest.fixture
-    def client(self):
-        """创建测试客户端"""
-        from app.main import app
-
-        return TestClient(app)
-
-    def test_root_endpoint(self, client):
+    async def test_root_endpoint(self, aclient):
         """根端点测试"""
-        response = client.get("/")
+        response = await aclient.get("/")
 
         assert response.status_code == 200
         data = response.json()
         assert data["message"] == "LiteKB API"
         assert "version" in data
 
-    def test_health_check(self, client):
+    async def test_health_check(self, aclient):
         """健康检查测试"""
-        response = client.get("/health")
+        response = await aclient.get("/health")
 
         assert response.status_code == 200
         data = response.json()
@@ -42,33 +34,27 @@ class TestAPIEndpoints:
 class TestAuthEndpoints:
     """认证端点测试"""
 
-    @pytest.fixture
-    def client(self):
-        from app.main import app
-
-        return TestClient(app)
-
-    def test_register_validation(self, client):
+    async def test_register_validation(self, aclient):
         """注册验证测试"""
         # 缺少必填字段
-        response = client.post("/api/v1/auth/register", json={})
+        response = await aclient.post("/api/v1/auth/register", json={})
 
         assert response.status_code == 422  # Validation error
 
-    def test_login_validation(self, client):
+    async def test_login_validation(self, aclient):
         """登录验证测试"""
         # 缺少必填字段
-        response = client.post("/api/v1/auth/login", json={})
+        response = await aclient.post("/api/v1/auth/login", json={})
 
         assert response.status_code == 422
 
-    def test_register_success(self, client):
+    async def test_register_success(self, aclient):
         """注册成功测试"""
         import uuid
 
         username = f"test_user_{uuid.uuid4().hex[:8]}"
 
-        response = client.post(
+        response = await aclient.post(
             "/api/v1/auth/register",
             json={
                 "username": username,
@@ -83,7 +69,7 @@ class TestAuthEndpoints:
         assert "id" in data
         assert "created_at" in data
 
-    def test_login_success(self, client):
+    async def test_login_success(self, aclient):
         """登录成功测试"""
         import uuid
 
@@ -91,12 +77,12 @@ class TestAuthEndpoints:
         password = "test_password_123"
 
         # 先注册
-        client.post(
+        await aclient.post(
             "/api/v1/auth/register", json={"username": username, "password": password}
         )
 
         # 再登录
-        response = client.post(
+        response = await aclient.post(
             "/api/v1/auth/login", json={"username": username, "password": password}
         )
 
@@ -105,7 +91,7 @@ class TestAuthEndpoints:
         assert "access_token" in data
         assert data["token_type"] == "bearer"
 
-    def test_login_wrong_password(self, client):
+    async def test_login_wrong_password(self, aclient):
         """错误密码测试"""
         import uuid
 
@@ -113,21 +99,21 @@ class TestAuthEndpoints:
         password = "correct_password"
 
         # 注册
-        client.post(
+        await aclient.post(
             "/api/v1/auth/register", json={"username": username, "password": password}
         )
 
         # 错误密码登录
-        response = client.post(
+        response = await aclient.post(
             "/api/v1/auth/login",
             json={"username": username, "password": "wrong_password"},
         )
 
         assert response.status_code == 400
 
-    def test_get_me_unauthorized(self, client):
+    async def test_get_me_unauthorized(self, aclient):
         """未授权访问测试"""
-        response = client.get("/api/v1/me")
+        response = await aclient.get("/api/v1/me")
 
         assert response.status_code == 401
 
@@ -135,39 +121,15 @@ class TestAuthEndpoints:
 class TestKBEndpoints:
     """知识库端点测试"""
 
-    @pytest.fixture
-    def client(self):
-        from app.main import app
-
-        return TestClient(app)
-
-    @pytest.fixture
-    def auth_headers(self, client):
-        """获取认证头"""
-        import uuid
-
-        username = f"kb_test_{uuid.uuid4().hex[:8]}"
-
-        client.post(
-            "/api/v1/auth/register", json={"username": username, "password": "test123"}
-        )
-
-        login_resp = client.post(
-            "/api/v1/auth/login", json={"username": username, "password": "test123"}
-        )
-
-        token = login_resp.json()["access_token"]
-        return {"Authorization": f"Bearer {token}"}
-
-    def test_create_kb_unauthorized(self, client):
+    async def test_create_kb_unauthorized(self, aclient):
         """未授权创建知识库"""
-        response = client.post("/api/v1/kb", json={"name": "Test KB"})
+        response = await aclient.post("/api/v1/kb", json={"name": "Test KB"})
 
         assert response.status_code == 401
 
-    def test_create_kb_success(self, client, auth_headers):
+    async def test_create_kb_success(self, aclient, auth_headers):
         """创建知识库成功"""
-        response = client.post(
+        response = await aclient.post(
             "/api/v1/kb", json={"name": "My Test Knowledge Base"}, headers=auth_headers
         )
 
@@ -177,18 +139,18 @@ class TestKBEndpoints:
         assert "id" in data
         assert data["doc_count"] == 0
 
-    def test_list_kbs_empty(self, client, auth_headers):
+    async def test_list_kbs_empty(self, aclient, auth_headers):
         """空知识库列表"""
-        response = client.get("/api/v1/kb", headers=auth_headers)
+        response = await aclient.get("/api/v1/kb", headers=auth_headers)
 
         assert response.status_code == 200
         data = response.json()
         assert isinstance(data, list)
 
-    def test_create_and_list_kb(self, client, auth_headers):
+    async def test_create_and_list_kb(self, aclient, auth_headers):
         """创建并列出知识库"""
         # 创建
-        create_resp = client.post(
+        create_resp = await aclient.post(
             "/api/v1/kb",
             json={"name": "Test KB 2", "description": "A test"},
             headers=auth_headers,
@@ -196,7 +158,7 @@ class TestKBEndpoints:
         kb_id = create_resp.json()["id"]
 
         # 列出
-        list_resp = client.get("/api/v1/kb", headers=auth_headers)
+        list_resp = await aclient.get("/api/v1/kb", headers=auth_headers)
 
         assert list_resp.status_code == 200
         kbs = list_resp.json()
@@ -204,22 +166,22 @@ class TestKBEndpoints:
         kb_ids = [kb["id"] for kb in kbs]
         assert kb_id in kb_ids
 
-    def test_get_kb_not_found(self, client, auth_headers):
+    async def test_get_kb_not_found(self, aclient, auth_headers):
         """获取不存在的知识库"""
-        response = client.get("/api/v1/kb/nonexistent_id", headers=auth_headers)
+        response = await aclient.get("/api/v1/kb/nonexistent_id", headers=auth_headers)
 
         assert response.status_code == 404
 
-    def test_update_kb(self, client, auth_headers):
+    async def test_update_kb(self, aclient, auth_headers):
         """更新知识库"""
         # 创建
-        create_resp = client.post(
+        create_resp = await aclient.post(
             "/api/v1/kb", json={"name": "Original Name"}, headers=auth_headers
         )
         kb_id = create_resp.json()["id"]
 
         # 更新
-        update_resp = client.put(
+        update_resp = await aclient.put(
             f"/api/v1/kb/{kb_id}",
             json={"name": "Updated Name", "description": "New desc"},
             headers=auth_headers,
@@ -228,21 +190,21 @@ class TestKBEndpoints:
         assert update_resp.status_code == 200
         assert update_resp.json()["name"] == "Updated Name"
 
-    def test_delete_kb(self, client, auth_headers):
+    async def test_delete_kb(self, aclient, auth_headers):
         """删除知识库"""
         # 创建
-        create_resp = client.post(
+        create_resp = await aclient.post(
             "/api/v1/kb", json={"name": "To Delete"}, headers=auth_headers
         )
         kb_id = create_resp.json()["id"]
 
         # 删除
-        del_resp = client.delete(f"/api/v1/kb/{kb_id}", headers=auth_headers)
+        del_resp = await aclient.delete(f"/api/v1/kb/{kb_id}", headers=auth_headers)
 
         assert del_resp.status_code == 200
 
         # 确认删除
-        get_resp = client.get(f"/api/v1/kb/{kb_id}", headers=auth_headers)
+        get_resp = await aclient.get(f"/api/v1/kb/{kb_id}", headers=auth_headers)
         assert get_resp.status_code == 404
 
 
@@ -250,39 +212,22 @@ class TestDocEndpoints:
     """文档端点测试"""
 
     @pytest.fixture
-    def setup(self):
-        """创建测试环境"""
-        from app.main import app
-
-        client = TestClient(app)
-
+    def setup(self, aclient, auth_headers):
+        """创建测试环境: 知识库直接写库, 不依赖知识库接口"""
         import uuid
 
-        username = f"doc_test_{uuid.uuid4().hex[:8]}"
+        from app.db.factory import db
 
-        client.post(
-            "/api/v1/auth/register", json={"username": username, "password": "test123"}
-        )
+        kb_id = str(uuid.uuid4())
+        db.create_kb(kb_id, {"name": "Doc Test KB", "created_by": "test"})
 
-        login_resp = client.post(
-            "/api/v1/auth/login", json={"username": username, "password": "test123"}
-        )
-        token = login_resp.json()["access_token"]
-        headers = {"Authorization": f"Bearer {token}"}
+        return aclient, auth_headers, kb_id
 
-        # 创建知识库
-        kb_resp = client.post(
-            "/api/v1/kb", json={"name": "Doc Test KB"}, headers=headers
-        )
-        kb_id = kb_resp.json()["id"]
-
-        return client, headers, kb_id
-
-    def test_create_doc(self, setup):
+    async def test_create_doc(self, setup):
         """创建文档测试"""
-        client, headers, kb_id = setup
+        aclient, headers, kb_id = setup
 
-        response = client.post(
+        response = await aclient.post(
             f"/api/v1/kb/{kb_id}/docs",
             json={"title": "Test Document", "content": "This is test content"},
             headers=headers,
@@ -291,69 +236,90 @@ class TestDocEndpoints:
         assert response.status_code == 200
         data = response.json()
         assert data["title"] == "Test Document"
-        assert data["status"] == "indexed"
+        # 索引由异步任务完成, 创建时为待处理
+        assert data["status"] == "pending"
+
+    async def test_create_doc_stream(self, setup):
+        """流式上传文档测试"""
+        aclient, headers, kb_id = setup
+
+        async def body():
+            for i in range(4):
+                yield f"Line {i} of a streamed document.\n".encode()
+
+        response = await aclient.post(
+            f"/api/v1/kb/{kb_id}/docs/stream",
+            params={"filename": "streamed.txt"},
+            content=body(),
+            headers={**headers, "Content-Type": "application/octet-stream"},
+        )
 
-    def test_list_docs_empty(self, setup):
+        assert response.status_code == 200
+        data = response.json()
+        assert data["title"] == "streamed"
+        assert "Line 3" in data["content"]
+
+    async def test_list_docs_empty(self, setup):
         """空文档列表"""
-        client, headers, kb_id = setup
+        aclient, headers, kb_id = setup
 
-        response = client.get(f"/api/v1/kb/{kb_id}/docs", headers=headers)
+        response = await aclient.get(f"/api/v1/kb/{kb_id}/docs", headers=headers)
 
         assert response.status_code == 200
         data = response.json()
         assert isinstance(data, list)
 
-    def test_create_and_list_docs(self, setup):
+    async def test_create_and_list_docs(self, setup):
         """创建并列出文档"""
-        client, headers, kb_id = setup
-
-        # 创建多个文档
-        for i in range(3):
-            client.post(
-                f"/api/v1/kb/{kb_id}/docs",
-                json={"title": f"Document {i}", "content": f"Content {i}"},
-                headers=headers,
-            )
+        aclient, headers, kb_id = setup
+
+        # 批量创建多个文档
+        batch_resp = await aclient.post(
+            f"/api/v1/kb/{kb_id}/docs:batch",
+            json=[
+                {"title": f"Document {i}", "content": f"Content {i}"} for i in range(3)
+            ],
+            headers=headers,
+        )
+        assert batch_resp.status_code == 200
 
         # 列出
-        response = client.get(f"/api/v1/kb/{kb_id}/docs", headers=headers)
+        response = await aclient.get(f"/api/v1/kb/{kb_id}/docs", headers=headers)
 
         assert response.status_code == 200
         docs = response.json()
         assert len(docs) == 3
 
+    async def test_create_docs_batch_too_large(self, setup):
+        """批量创建超过上限返回 422"""
+        from app.main import DOCS_BATCH_MAX
 
-class TestChatEndpoints:
-    """对话端点测试"""
-
-    @pytest.fixture
-    def setup(self):
-        from app.main import app
+        aclient, headers, kb_id = setup
 
-        client = TestClient(app)
+        response = await aclient.post(
+            f"/api/v1/kb/{kb_id}/docs:batch",
+            json=[{"title": f"Document {i}"} for i in range(DOCS_BATCH_MAX + 1)],
+            headers=headers,
+        )
 
-        import uuid
+        assert response.status_code == 422
 
-        username = f"chat_test_{uuid.uuid4().hex[:8]}"
 
-        client.post(
-            "/api/v1/auth/register", json={"username": username, "password": "test123"}
-        )
+class TestChatEndpoints:
+    """对话端点测试"""
 
-        login_resp = client.post(
-            "/api/v1/auth/login", json={"username": username, "password": "test123"}
-        )
-        token = login_resp.json()["access_token"]
-        headers = {"Authorization": f"Bearer {token}"}
+    @pytest_asyncio.fixture(loop_scope="session")
+    async def setup(self, aclient, auth_headers):
+        headers = auth_headers
 
         # 创建知识库和文档
-        kb_resp = client.post(
+        kb_resp = await aclient.post(
             "/api/v1/kb", json={"name": "Chat Test KB"}, headers=headers
         )
         kb_id = kb_resp.json()["id"]
 
         # 添加文档
-        client.post(
+        await aclient.post(
             f"/api/v1/kb/{kb_id}/docs",
             json={
                 "title": "AI Guide",
@@ -362,24 +328,24 @@ class TestChatEndpoints:
             headers=headers,
         )
 
-        return client, headers, kb_id
+        return aclient, headers, kb_id
 
-    def test_chat_without_kb(self, setup):
+    async def test_chat_without_kb(self, setup):
         """不存在的知识库对话"""
-        client, headers, _ = setup
+        aclient, headers, _ = setup
 
-        response = client.post(
+        response = await aclient.post(
             "/api/v1/kb/nonexistent/chat", json={"message": "Hello"}, headers=headers
         )
 
         assert response.status_code == 404
 
-    def test_chat_request_validation(self, setup):
+    async def test_chat_request_validation(self, setup):
         """对话请求验证"""
-        client, headers, kb_id = setup
+        aclient, headers, kb_id = setup
 
         # 空消息
-        response = client.post(
+        response = await aclient.post(
             f"/api/v1/kb/{kb_id}/chat", json={"message": ""}, headers=headers
         )
 
@@ -3,12 +3,23 @@
 """
 
 import pytest
+from dataclasses import dataclass
 from unittest.mock import Mock, patch, AsyncMock
 from fastapi import HTTPException
-import sys
-import os
 
-sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@dataclass(slots=True)
+class UserStub:
+    """用户桩对象 (只需 id)"""
+
+    id: str
+
+
+@dataclass(slots=True)
+class OrgStub:
+    """组织桩对象 (只需 id)"""
+
+    id: str
 
 
 class TestAuth:
@@ -98,7 +109,9 @@ class TestAuth:
 
         # 创建 AuthContext
         auth = AuthContext(
-            user=Mock(id="user_1"), organization=Mock(id="org_1"), member_role="admin"
+            user=UserStub(id="user_1"),
+            organization=OrgStub(id="org_1"),
+            member_role="admin",
         )
 
         # Admin 应该有权
@@ -114,8 +127,8 @@ class TestAuth:
         """AuthContext 属性测试"""
         from app.auth import AuthContext
 
-        user = Mock(id="user_123")
-        org = Mock(id="org_456")
+        user = UserStub(id="user_123")
+        org = OrgStub(id="org_456")
 
         auth = AuthContext(
             user=user,
@@ -156,7 +169,7 @@ class TestCache:
         key = cache.make_key("search", "test query", "kb_123")
 
         assert isinstance(key, str)
-        assert len(key) == 32  # MD5 hex
+        assert len(key) == 32  # 16 字节 blake2b 摘要的 hex
 
     def test_make_key_consistency(self):
         """相同输入生成相同 Key"""
@@ -4,12 +4,7 @@
 
 import pytest
 import asyncio
-from unittest.mock import Mock, patch, AsyncMock
-import sys
-import os
-
-# 添加 backend 到路径
-sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from unittest.mock import ANY, Mock, patch, AsyncMock
 
 
 class TestDocumentProcessor:
@@ -94,6 +89,20 @@ class TestChunkingStrategies:
             overlap = processor.chunk_overlap
             assert chunks[0][-overlap:] == chunks[1][:overlap]
 
+    def test_chinese_sentence_boundary(self):
+        """中文句末标点断句测试"""
+        from app.services.document import DocumentProcessor
+
+        processor = DocumentProcessor()
+        processor.chunk_size = 20
+        processor.chunk_overlap = 0
+
+        text = "这是第一句比较长的中文句子内容。这是第二句同样很长的中文句子。"
+
+        chunks = processor.split_chunks(text)
+
+        assert chunks[0].endswith("。")
+
 
 class TestSearchEngine:
     """搜索引勤测试"""
@@ -110,6 +119,7 @@ class TestSearchEngine:
         keyword_results = [
             SearchResult(
                 id="doc2",
+                title="doc2",
                 content="content2",
                 score=0.95,
                 source_type="keyword",
@@ -117,6 +127,7 @@ class TestSearchEngine:
             ),
             SearchResult(
                 id="doc3",
+                title="doc3",
                 content="content3",
                 score=0.7,
                 source_type="keyword",
@@ -128,7 +139,20 @@ class TestSearchEngine:
 
         assert len(results) == 3
         # doc2 在两个列表中都出现，应该排名靠前
-        assert results[0].id == "doc2"
+        assert results[0]["id"] == "doc2"
+
+    def test_rrf_fusion_missing_id(self):
+        """缺少 id 的结果不报错, 也不与其他结果合并"""
+        from app.services.search import rrf_fuse
+
+        vector_results = [{"id": "doc1", "score": 0.9}, {"score": 0.8}]
+        keyword_results = [{"score": 0.7}, {"id": "doc1", "score": 0.6}]
+
+        results = rrf_fuse(vector_results, keyword_results, top_k=10)
+
+        assert len(results) == 3
+        assert results[0]["id"] == "doc1"
+        assert all("id" not in r for r in results[1:])
 
 
 class TestRAGEngine:
@@ -175,6 +199,288 @@ class TestRAGEngine:
         assert "上下文" in prompt
 
 
+class TestPromptManager:
+    """提示词渲染测试"""
+
+    def test_render_default_prompt(self):
+        """默认模板变量替换测试"""
+        from app.services.prompt import entity_extraction_prompt
+
+        prompt = entity_extraction_prompt("Alice joined Acme")
+
+        assert "Alice joined Acme" in prompt
+        assert "{text}" not in prompt
+
+    def test_render_placeholder_forms(self):
+        """多种占位符写法测试"""
+        from app.services.prompt import _render
+
+        rendered = _render("{{a}} ${b} {c} {missing}", {"a": 1, "b": 2, "c": 3})
+
+        assert rendered == "1 2 3 {missing}"
+
+    def test_langfuse_template_uses_same_placeholders(self):
+        """Langfuse 模板解析与本地渲染识别相同的占位符"""
+        from app.services.prompt import _render
+        from app.tracing.langfuse import _parse_template
+
+        template = "{{ a }} ${b} {c} {missing}"
+        variables = {"a": 1, "b": 2, "c": 3}
+        compiled = "".join(
+            literal + (str(variables[var]) if var in variables else raw)
+            for literal, var, raw in _parse_template(template)
+        )
+
+        assert compiled == _render(template, variables) == "1 2 3 {missing}"
+
+    def test_langfuse_index_paginates_and_expires(self):
+        """名称索引分页加载, 过期后重新加载"""
+        from types import SimpleNamespace
+        from app.services.prompt import PromptManager
+
+        pages = {
+            1: ["rag_naive"],
+            2: ["entity_extraction"],
+        }
+
+        def get_prompts(page, limit):
+            return SimpleNamespace(
+                data=[SimpleNamespace(name=n) for n in pages[page]],
+                meta=SimpleNamespace(total_pages=len(pages)),
+            )
+
+        manager = PromptManager()
+        manager._enabled = True
+        manager._langfuse_client = Mock(get_prompts=Mock(side_effect=get_prompts))
+
+        assert manager._in_langfuse("entity_extraction")
+        assert not manager._in_langfuse("summarize")
+
+        pages[2].append("summarize")
+        manager._index_expires = 0.0
+        assert manager._in_langfuse("summarize")
+        assert manager._langfuse_client.get_prompts.call_count == 4
+
+    def test_langfuse_index_loads_outside_lock(self):
+        """加载索引期间不持有锁, 其他线程可读取提示词缓存"""
+        import threading
+        from types import SimpleNamespace
+        from app.services.prompt import PromptManager
+
+        manager = PromptManager()
+        acquired = []
+
+        def try_lock():
+            got = manager._lock.acquire(timeout=1)
+            acquired.append(got)
+            if got:
+                manager._lock.release()
+
+        def get_prompts(page, limit):
+            # 在另一个线程中尝试获取锁, 持锁加载时会超时
+            t = threading.Thread(target=try_lock)
+            t.start()
+            t.join()
+            return SimpleNamespace(
+                data=[SimpleNamespace(name="rag_naive")],
+                meta=SimpleNamespace(total_pages=1),
+            )
+
+        manager._enabled = True
+        manager._langfuse_client = Mock(get_prompts=Mock(side_effect=get_prompts))
+
+        assert manager._in_langfuse("rag_naive")
+        assert acquired == [True]
+        assert not manager._index_loading
+
+
+class TestTracing:
+    """追踪测试"""
+
+    def test_child_of_sampled_out_trace_stays_local(self, monkeypatch):
+        """未采样请求下创建的 span/generation 为本地对象且可正常结束"""
+        from app.tracing import langfuse
+        from app.tracing.langfuse import (
+            LangfuseTracing,
+            LocalGeneration,
+            LocalSpan,
+            LocalTrace,
+            current_trace_var,
+        )
+
+        monkeypatch.setattr(langfuse, "_sampler", lambda name, trace_id: False)
+        tracing = LangfuseTracing.__new__(LangfuseTracing)
+        tracing._enabled_flag = True
+
+        trace = tracing.create_trace("GET /api/v1/kb")
+        assert isinstance(trace, LocalTrace)
+
+        token = current_trace_var.set(trace)
+        try:
+            span = tracing.create_span(None, "search", {"k": 1})
+            generation = tracing.create_generation(None, "llm", "q", "gpt", "a")
+        finally:
+            current_trace_var.reset(token)
+
+        assert isinstance(span, LocalSpan)
+        assert isinstance(generation, LocalGeneration)
+        span.event("hit")
+        span.end()
+        generation.end(usage={"input": 1})
+        assert trace.stats()["spans"] == 1
+        assert trace.stats()["generations"] == 1
+
+    @pytest.mark.asyncio
+    async def test_event_batcher_close_submits_pending(self):
+        """关闭时提交尚未到批量阈值的事件"""
+        from app.tracing.langfuse import LocalTrace
+        from app.tracing.middleware import _EventBatcher
+
+        batcher = _EventBatcher()
+        trace = LocalTrace("GET /api/v1/kb")
+        batcher.put(trace, "event", ("request_received", {}))
+        batcher.put(trace, "end", {"status_code": 200})
+        await asyncio.sleep(0)
+
+        await batcher.close()
+        assert trace.stats()["events"] == 1
+        assert batcher._queue.empty()
+
+    @pytest.mark.asyncio
+    async def test_mirror_projects_receive_full_trace(self):
+        """trace/span/generation 的创建经批量队列, 每个项目收到相同数据"""
+        import orjson
+        from app.tracing.langfuse import LangfuseTracing, _IngestQueue
+
+        sinks = [Mock(post=AsyncMock(), base_url=f"http://sink{i}") for i in range(2)]
+        tracing = LangfuseTracing.__new__(LangfuseTracing)
+        tracing._enabled_flag = True
+        tracing._client = Mock()
+        tracing._ingest = _IngestQueue(*sinks)
+
+        trace = tracing.create_trace("POST /api/v1/chat", user_id="u1")
+        span = tracing.create_span(trace, "retrieval")
+        span.end()
+        generation = tracing.create_generation(trace, "llm", "q", "gpt")
+        generation.end(output="a")
+        trace.end({"status_code": 200})
+        await tracing._ingest.flush()
+        tracing._ingest.shutdown()
+
+        contents = [sink.post.call_args.kwargs["content"] for sink in sinks]
+        assert contents[0] == contents[1]
+        batch = orjson.loads(contents[0])["batch"]
+        assert [e["type"] for e in batch] == [
+            "trace-create",
+            "span-create",
+            "span-update",
+            "generation-create",
+            "generation-update",
+            "trace-create",
+        ]
+        assert batch[0]["body"]["name"] == "POST /api/v1/chat"
+        assert batch[3]["body"]["input"] == "q"
+        assert {e["body"]["traceId"] for e in batch[1:5]} == {trace.id}
+        tracing._client.trace.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_errored_request_promotes_sampled_out_trace(self, monkeypatch):
+        """未采样的请求出错时补报, 已排队的事件与子 span 的错误都上报"""
+        import httpx
+        from fastapi import FastAPI
+        from app.tracing import langfuse, middleware
+        from app.tracing.decorators import LLMTracker
+        from app.tracing.langfuse import LangfuseTracing
+
+        monkeypatch.setattr(langfuse, "_sampler", lambda name, trace_id: False)
+        tracing = LangfuseTracing.__new__(LangfuseTracing)
+        tracing._enabled_flag = True
+        tracing._client = Mock()
+        tracing._ingest = None
+        batcher = middleware._EventBatcher()
+        monkeypatch.setattr(middleware, "langfuse", tracing)
+        monkeypatch.setattr(middleware, "event_batcher", batcher)
+
+        tracker = LLMTracker()
+        tracker.enabled = True
+
+        @tracker.trace_call(name="llm", provider="openai", model="gpt")
+        async def call_llm():
+            raise RuntimeError("boom")
+
+        api = FastAPI()
+
+        @api.get("/api/v1/boom")
+        async def boom():
+            await call_llm()
+
+        api.add_middleware(middleware.TracingMiddleware)
+        transport = httpx.ASGITransport(app=api)
+        async with httpx.AsyncClient(transport=transport, base_url="http://t") as c:
+            response = await c.get("/api/v1/boom")
+        await asyncio.sleep(0)
+        await batcher.close()
+
+        assert response.status_code == 500
+        tracing._client.trace.assert_any_call(
+            id=ANY, name="GET /api/v1/boom", metadata=ANY, user_id=None
+        )
+        events = [call.kwargs["name"] for call in tracing._client.event.call_args_list]
+        assert {"request_received", "function_start", "error"} <= set(events)
+        span_events = [
+            call.kwargs
+            for call in tracing._client.event.call_args_list
+            if call.kwargs.get("parent_observation_id")
+        ]
+        assert {e["name"] for e in span_events} >= {"function_start", "error"}
+
+    @pytest.mark.asyncio
+    async def test_ingest_queue_close_stops_worker(self):
+        """close 停止后台任务并上报其正在聚合的批次"""
+        import orjson
+        from app.tracing.langfuse import _IngestQueue
+
+        sink = Mock(post=AsyncMock(), base_url="http://sink")
+        ingest = _IngestQueue(sink)
+        for i in range(3):
+            ingest.put_nowait("event-create", {"id": str(i)})
+        await asyncio.sleep(0)
+        worker = ingest._worker
+
+        await ingest.close()
+
+        assert worker.done()
+        batch = orjson.loads(sink.post.call_args.kwargs["content"])["batch"]
+        assert [e["body"]["id"] for e in batch] == ["0", "1", "2"]
+
+    @pytest.mark.asyncio
+    async def test_iter_generations_fetches_page_by_page(self):
+        """逐页请求, 最后一页未取满时不再请求"""
+        from types import SimpleNamespace
+        from app.tracing.langfuse import GENERATIONS_PAGE_SIZE, LangfuseTracing
+
+        sizes = {1: GENERATIONS_PAGE_SIZE, 2: 3}
+        requested = []
+
+        async def get(path, params):
+            requested.append(params["page"])
+            data = [{"name": "llm"}] * sizes.get(params["page"], 0)
+            return SimpleNamespace(
+                raise_for_status=lambda: None, json=lambda: {"data": data}
+            )
+
+        tracing = LangfuseTracing.__new__(LangfuseTracing)
+        tracing._enabled_flag = True
+        tracing._http = SimpleNamespace(get=get)
+
+        rows = [
+            g async for g in tracing.iter_generations(limit=5 * GENERATIONS_PAGE_SIZE)
+        ]
+
+        assert len(rows) == GENERATIONS_PAGE_SIZE + 3
+        assert requested == [1, 2]
+
+
 class TestKnowledgeGraph:
     """知识图谱测试"""
 
@@ -210,9 +516,64 @@ class TestKnowledgeGraph:
         assert relation.confidence == 0.95
 
 
+class TestEmbedding:
+    """嵌入模型测试"""
+
+    def test_embedding_model_singleton(self):
+        """嵌入模型全局只创建一次"""
+        pytest.importorskip("sentence_transformers")
+        from app.services.local_embedding import get_embedding_model
+
+        assert get_embedding_model() is get_embedding_model()
+
+
+class TestTasks:
+    """异步任务测试"""
+
+    def test_process_document_batch(self):
+        """批量任务: 分块、生成向量并写入向量库, 文档标记为已索引"""
+        import uuid
+
+        from app.db.orm_store import orm_store
+        from app.data_models import Document
+        from app.tasks import process_document_batch
+
+        kb_id = str(uuid.uuid4())
+        orm_store.create_kb(kb_id, {"name": "Task KB", "created_by": "test"})
+        docs = orm_store.create_docs(
+            [
+                (
+                    str(uuid.uuid4()),
+                    {"kb_id": kb_id, "title": f"d{i}", "content": f"Doc {i}. More."},
+                )
+                for i in range(2)
+            ]
+        )
+        doc_ids = [doc.id for doc in docs]
+
+        embed = AsyncMock(side_effect=lambda texts: [[0.0] * 3 for _ in texts])
+        with patch("app.services.vector.embedding_api.embed_texts", embed), patch(
+            "app.services.vector.vector_store.add", AsyncMock()
+        ) as add:
+            result = process_document_batch.run(doc_ids, kb_id)
+
+        assert result["docs_count"] == 2
+        assert result["chunks_count"] == len(add.call_args.args[0])
+        session = orm_store.get_session()
+        try:
+            statuses = {
+                d.status
+                for d in session.query(Document).filter(Document.id.in_(doc_ids))
+            }
+        finally:
+            session.close()
+        assert statuses == {"indexed"}
+
+
 class TestConfig:
     """配置测试"""
 
+    @pytest.mark.xdist_group("config")
     def test_settings_load(self):
         """设置加载测试"""
         from app.config import settings, get_settings